@@ -3,15 +3,21 @@
 
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go  # to enable total count labels on top of stacked bar chart
-import requests
-from tqdm import tqdm
-from stqdm import stqdm
-from time import sleep
-import glob
-
-stqdm.pandas()
+import logging
+import threading
+
+import charts
+from aggregates import file_hash, profile_tables
+from exports import ExportStage
+from filters import ProfileFilter, filter_options, filtered_tables
+from institutions import INSTITUTION_IDS, nospaces, data_dir
+from funders import FUNDER_LOOKUP_FILE, FunderIndex, load_funder_matcher
+from instrumentation import Trace, stage
+from pipeline import find_merged_file, export_profile, profile_merged_file
+from schema import with_detail
+from sections import section, debug_enabled
+from shared_cache import SharedFrameCache
+from summary_store import stored_hash, summarize, update_summary
 
 st.header('IOI Publishing Profiler')
 st.markdown('#### Eric Schares')
@@ -28,57 +34,115 @@ with st.expander('More information:'):
 
 #st.markdown('---')
 
-# make sure these names are what appears in the Dimensions export file for CA
-# For example, is it MIT or Massachusetts Institute of Technology?
-institution_name = st.selectbox('**Choose an Institution to Analyze**', ['Iowa State University', 'Yale', 'MIT', 'test'])
-institution_name_nospaces = institution_name.replace(' ', '')    # need a version of the name that can go into a filename
-
-# OpenAlex IDs, lookup with https://api.openalex.org/institutions?search=name
-institution_ids  = {'Iowa State University': 'I173911158',
-                    'Yale': 'I32971472',
-                    'MIT': 'I63966007',
-                    'test': 'I173911158'}
+# institutions and their OpenAlex IDs live in institutions.py, batch.py uses the same list
+institution_name = st.selectbox('**Choose an Institution to Analyze**', list(INSTITUTION_IDS))
+institution_name_nospaces = nospaces(institution_name)    # need a version of the name that can go into a filename
+institution_ids = INSTITUTION_IDS
 
 institution_id = institution_ids[institution_name]    # used in OpenAlex data enrichment for Corresponding Authors
 st.write(f'OpenAlex Institution ID: **{institution_id}**')
 
+# ?debug=1 in the URL times every stage of this run (see instrumentation.py) and shows it in the sidebar
+# a run cut short by a rerun never gets to finish its trace, so that happens at the start of the next one
+unfinished_trace = st.session_state.pop('debug_trace', None)
+if unfinished_trace is not None and not unfinished_trace.finished:
+    unfinished_trace.finish()
+debug_trace = Trace(f'app {institution_name_nospaces}', memory=True).start() if debug_enabled() else None
+st.session_state['debug_trace'] = debug_trace
+
 st.markdown('---')
 st.subheader('Load Data')
 
 
 
 ### Load data - do it this way so it's not re-loaded over and over again each time we save this file
-@st.cache_data
-def load_data_excel(link, header):
-   st.write(f'Loading file **{link}**')
-   df = pd.read_excel(link, header=header)
-   return df
+# One shared copy per server process for every session, instead of st.cache_data's copy per caller.
+# Least recently used institutions get dropped once the cache is over SHARED_CACHE_MB
+SHARED_CACHE_MB = 2048
+
+@st.cache_resource
+def get_shared_cache(max_mb):
+   return SharedFrameCache(max_bytes=max_mb * 2**20)
+
+shared_cache = get_shared_cache(SHARED_CACHE_MB)
+
+# the matching engine (normalized names + word trie) is built once per version of the mapping file
+def load_funder_mapping_shared():
+   return shared_cache.get_or_build(('funder_matcher', file_hash(FUNDER_LOOKUP_FILE)),
+                                    lambda: load_funder_matcher(FUNDER_LOOKUP_FILE), group='funder_mapping')
+
+# source_hash is part of the key, so a changed parquet file gets rebuilt (and replaces the old version)
+def load_profile(link, source_hash, announce=True):
+   def build():
+      if announce:
+         st.write(f'Loading file **{link}**')
+      # uses the cube batch.py/warm_start.py built for this exact file if there is one, streams really big files
+      return profile_merged_file(link, mapping=load_funder_mapping_shared(), source_hash=source_hash)
+   return shared_cache.get_or_build(('profile', link, source_hash), build, group=('profile', link))
+
+def load_tables(link, source_hash, cube):
+   return shared_cache.get_or_build(('tables', link, source_hash), lambda: profile_tables(cube), group=('tables', link))
 
-@st.cache_data
-def load_data_csv(link, header):
-   st.write(f'Loading file **{link}**')
-   df = pd.read_csv(link, header=header)
-   return df
+# figures only carry the pre-binned bars (see charts.py), each one is built once per file/toggle/funder and shared too
+def cached_figure(build, *key):
+   def timed_build():
+      with stage(f'figure {key[0]}'):
+         return build()
+   return shared_cache.get_or_build(('figure', merged_file, source_hash, profile_filter) + key, timed_build)
 
-@st.cache_data
-def load_data_parquet(link, header):
-   st.write(f'Loading file **{link}**')
-   df = pd.read_parquet(link)
-   return df
+
+# only loaded when a funder is picked, the DOI-level rows are left out of the cache key since they follow from the rest
+@st.cache_data(max_entries=32)
+def load_detail(link, source_hash, chosen_funder, profile_filter, _chosen_funder_DOIlevel):
+   with stage('detail columns', rows_in=len(_chosen_funder_DOIlevel)):
+      return with_detail(_chosen_funder_DOIlevel, link, profile_filter)
+
+
+# CSV/Parquet side outputs get written in the background, and only when their content changed
+EXPORT_FORMAT = 'csv'    # or 'parquet' for zstd compressed files
+
+@st.cache_resource
+def get_exporter(fmt):
+   return ExportStage(fmt=fmt)
+
+exporter = get_exporter(EXPORT_FORMAT)
+export_prefix = f'data/{institution_name_nospaces}/{institution_name_nospaces}'
 
 
 ### Load dataframe of merged publications ###
 merged_file_flag = 0
-df_file_picker = glob.glob(f'data/{institution_name_nospaces}/*_merged_small.parquet')
-#df_file_picker
-if df_file_picker:
+merged_file = find_merged_file(data_dir(institution_name))
+if merged_file:
     openalex_file_flag = 1
-    if(df_file_picker[0].endswith('.xlsx')):
-        merged = load_data_excel(df_file_picker[0], 1)      # df_file_picker is a list, get the 0th element, header=1 if Excel file
-    else:
-        merged = load_data_parquet(df_file_picker[0], 0)
+    source_hash = file_hash(merged_file)
+    yesyes, funders_exploded, cube = load_profile(merged_file, source_hash)
+    full_tables = load_tables(merged_file, source_hash, cube)
 else:
     st.write('No file found')
+    if debug_trace is not None:
+        debug_trace.finish()
+    st.stop()
+
+
+# Filters in the sidebar, the choices come from this institution's own data
+# Everything below is drawn from the filtered cube, the exports and the summary store always get the full data
+options = shared_cache.get_or_build(('filter_options', merged_file, source_hash), lambda: filter_options(cube), group=('filter_options', merged_file))
+with st.sidebar:
+    st.subheader('Filters')
+    years = options['years']
+    all_years = (years[0], years[-1]) if years else None    # None when no record has a usable PubYear
+    if len(years) > 1:
+        chosen_years = st.select_slider('PubYear', options=years, value=all_years)
+    else:
+        chosen_years = all_years
+    chosen_open_access = st.multiselect('Open Access status', options['open_access'], placeholder='All')
+    chosen_publishers = st.multiselect('Publisher', options['publishers'], placeholder='All')
+
+# the whole year range is the same as no year filter, so it shares the unfiltered tables
+profile_filter = ProfileFilter.make(years=None if chosen_years == all_years else chosen_years,
+                                    open_access=chosen_open_access, publishers=chosen_publishers)
+# every filtered cube/tables is its own entry in the shared cache, sized and evicted like the full ones
+tables = filtered_tables(shared_cache, merged_file, source_hash, cube, full_tables, profile_filter)
 
 
 # TODO can we get away with just loading *_merged if it's available? Have to test if it is, can't go off OpenAlex data bc need to do that first
@@ -93,92 +157,78 @@ else:
 
 #merged
 
-yesyes = merged[merged['is_USFF_is_corresponding']=='yes_yes']
 #st.subheader('YesYes')
-yesyes.to_csv(f'data/{institution_name_nospaces}/{institution_name_nospaces}_yesyes.csv', index=False)
-
+export_profile(exporter, export_prefix, yesyes, funders_exploded, cube, key=source_hash, merged_file=merged_file)
 
+# keep this institution's yearly counts in the summary store for the Compare Institutions page, once per file version
+# the store is read and rewritten by the exporter's threads, not while the page is drawn
+def add_to_summary_store(cube, institution_name, institution_id, source_hash):
+   if stored_hash(institution_id, institution_name) != source_hash:
+      update_summary(summarize(cube, institution_name, institution_id, source_hash))
 
+exporter.submit_task(f'summary store {institution_name_nospaces}', add_to_summary_store, cube, institution_name, institution_id, source_hash,
+                     key=source_hash)
 ###### Plots ######
+# Each part of the page is a section (see sections.py) that gets its data passed in.
+# Picking a different institution reruns everything, the top 20 toggle reruns only the journal and funder charts,
+# and picking a different funder reruns only its table and fig12/fig14
 
-st.markdown('---')
-st.subheader(f'Corresponding Authored Records by {institution_name}, by Year')
-col1, col2 = st.columns(2)
+@section('Corresponding / USFF by year')
+def by_year_section(tables, institution_name):
+    st.markdown('---')
+    st.subheader(f'Corresponding Authored Records by {institution_name}, by Year')
+    col1, col2 = st.columns(2)
 
-fig = px.histogram(merged, x='PubYear', color='is_corresponding', text_auto=True,
-             color_discrete_map={
-                "yes": "blue",
-                "no": "salmon",
-                "unknown": "lightgray"},
-                category_orders={"is_corresponding": ["yes", "no"]})
-fig.update_xaxes(type='category', categoryorder='category ascending')
-fig.update_layout(legend_traceorder='reversed')#, width=500)
+    is_corresponding_by_year = tables['is_corresponding_by_year']
 
+    fig = cached_figure(lambda: charts.flag_by_year(is_corresponding_by_year, 'is_corresponding'), 'fig')
 
-# col1.subheader('Raw Counts')
-# col1.plotly_chart(fig)
 
-fig2 = px.histogram(merged, x='PubYear', color='is_corresponding', barnorm='percent', text_auto=True,
-             color_discrete_map={
-                "yes": "blue",
-                "no": "salmon",
-                "unknown": "lightgray"},
-                category_orders={"is_corresponding": ["yes", "no"]})
-fig2.update_xaxes(type='category', categoryorder='category ascending')
-fig2.update_layout(legend_traceorder='reversed')#, width=500)
+    # col1.subheader('Raw Counts')
+    # col1.plotly_chart(fig)
 
-# col2.subheader('Percentages')
-# col2.plotly_chart(fig2)
+    fig2 = cached_figure(lambda: charts.flag_by_year(is_corresponding_by_year, 'is_corresponding', percent=True), 'fig2')
 
-with col1:
-    st.markdown('#### Raw Counts')
-    st.plotly_chart(fig)
+    # col2.subheader('Percentages')
+    # col2.plotly_chart(fig2)
 
-with col2:
-    st.markdown('#### Percentages')
-    st.plotly_chart(fig2)
+    with col1:
+        st.markdown('#### Raw Counts')
+        st.plotly_chart(fig)
 
+    with col2:
+        st.markdown('#### Percentages')
+        st.plotly_chart(fig2)
 
 
-st.markdown('---')
-st.subheader(f'US Federally Funded Research with any {institution_name} author, by Year')
-col3, col4 = st.columns(2)
 
-fig3 = px.histogram(merged, x='PubYear', color='is_USFF', text_auto=True,
-             color_discrete_map={
-                "yes": "blue",
-                "no": "salmon",
-                "unknown": "lightgray"},
-                category_orders={"is_USFF": ["yes", "no"]})
-fig3.update_xaxes(type='category', categoryorder='category ascending')
-fig3.update_layout(legend_traceorder='reversed')
+    st.markdown('---')
+    st.subheader(f'US Federally Funded Research with any {institution_name} author, by Year')
+    col3, col4 = st.columns(2)
 
-# col1.plotly_chart(fig3)
+    is_USFF_by_year = tables['is_USFF_by_year']
 
-fig4 = px.histogram(merged, x='PubYear', color='is_USFF', barnorm='percent', text_auto=True,
-             color_discrete_map={
-                "yes": "blue",
-                "no": "salmon",
-                "unknown": "lightgray"},
-                category_orders={"is_USFF": ["yes", "no"]})
-fig4.update_xaxes(type='category', categoryorder='category ascending')
-fig4.update_layout(legend_traceorder='reversed')
+    fig3 = cached_figure(lambda: charts.flag_by_year(is_USFF_by_year, 'is_USFF'), 'fig3')
 
-# col2.plotly_chart(fig4)
+    # col1.plotly_chart(fig3)
 
-with col3:
-    st.subheader('Raw Counts')
-    st.plotly_chart(fig3)
+    fig4 = cached_figure(lambda: charts.flag_by_year(is_USFF_by_year, 'is_USFF', percent=True), 'fig4')
 
-with col4:
-    st.subheader('Percentages')
-    st.plotly_chart(fig4)
+    # col2.plotly_chart(fig4)
 
+    with col3:
+        st.subheader('Raw Counts')
+        st.plotly_chart(fig3)
 
+    with col4:
+        st.subheader('Percentages')
+        st.plotly_chart(fig4)
 
-st.markdown('---')
-st.subheader(f'{institution_name} Corresponding Authored US Federally Funded Research, by Year')
-bullet_text = ''' Legend shows many combinations of Correspoding Author and US federal funding
+
+
+    st.markdown('---')
+    st.subheader(f'{institution_name} Corresponding Authored US Federally Funded Research, by Year')
+    bullet_text = ''' Legend shows many combinations of Correspoding Author and US federal funding
 * **'unknown_no'** means we don't know if the CorrAuth is from the institution of interest, but it's not federally funded (available only if data ran through OpenAlex)
 * **'unknown_yes'** means it **is** federally funded, but we still don't have the CorrAuth information
 * **'no_no'** are publications that are neither CorrAuth by our institution or federally funded
@@ -187,339 +237,223 @@ bullet_text = ''' Legend shows many combinations of Correspoding Author and US f
 * **['yes_yes]** *finally* the records we are interested in. CorrAuth is from the insitution and also have federal funding acknowledged
 '''
 
-st.markdown(bullet_text)
-
-col5, col6 = st.columns(2)
-
-fig5 = px.histogram(merged, x='PubYear', color='is_corresponding_is_USFF', text_auto=True,
-             color_discrete_map={
-                "yes_yes": "blue",
-                "yes_no": "lightblue",
-                "no_yes": "salmon",
-                "no_no": "lightgray"},
-                category_orders={"is_corresponding_is_USFF": ["yes_yes", "yes_no", "no_yes", "no_no"]})
-fig5.update_xaxes(type='category', categoryorder='category ascending')
-fig5.update_layout(legend_traceorder='reversed')
-
-fig6 = px.histogram(merged, x='PubYear', color='is_corresponding_is_USFF', barnorm='percent', text_auto=True,
-             color_discrete_map={
-                "yes_yes": "blue",
-                "yes_no": "lightblue",
-                "no_yes": "salmon",
-                "no_no": "lightgray"},
-                category_orders={"is_corresponding_is_USFF": ["yes_yes", "yes_no", "no_yes", "no_no"]})
-fig6.update_xaxes(type='category', categoryorder='category ascending')
-fig6.update_layout(legend_traceorder='reversed')
-
-
-with col5:
-    st.subheader('Raw Counts')
-    st.plotly_chart(fig5)
-
-with col6:
-    st.subheader('Percentages')
-    st.plotly_chart(fig6)
-
-
-
-# base code from StackOverflow user Maarten Fabré, modified by Eric Schares
-# this is VERY hardcoded to what I'm trying to do so edit carefully
-# for example, I hardcode the yesyes_bypublisher['PubYear'] filter
-# had to do it this way to automate the calcuation by year of number of publishers that make up 50%
-def get_50_percent_passyear(year, pct=50):
-    '''
-    Input: year as int
-    Returns: int, length of Series required to meet pct level, defaults to 50%  (example: 4)
-    '''    
-    group = yesyes_bypublisher[yesyes_bypublisher['PubYear']==year]
-    
-    # moves is one Series, in this case DOI. Descending series of counts
-    moves = group['DOI'].sort_values(ascending=False)
-    #print(moves)
-    
-    # cumsum is series of fractions, cumulatively summing each row (0.21, 0.34. 0.45, 0.56)
-    cumsum = moves.cumsum() / moves.sum()
-    #print(cumsum)
-    
-    # idx is the length of cumulative sum where it is still less than .50, then go one more
-    idx = len(cumsum[cumsum < pct/100]) + 1
-    #print(f'idx: {idx}\n')
-    
-    # `idx` is the first index which has a cumulative sum of `pct` or higher
-    # so grab indexes 0 to whatever index we need
-    idx = moves.index[:idx]  
-    #print(f'second idx: {idx}')
-    
-    # here, `idx` is the Index of all the moves with a cumulative contribution of `pct` or higher
-    #print(f'here is {group.loc[idx]}')
-    return len(group.loc[idx].set_index(['Publisher'], drop=True)['DOI'])
+    st.markdown(bullet_text)
 
+    col5, col6 = st.columns(2)
 
-st.markdown('---')
-st.header(f"Further Details on the 'yes_yes' Section")
-st.subheader(f'Look at {institution_name} Corresponding Authored & Federally Funded Documents')
-st.subheader('Breakdown by **:red[Publisher]**')
-#col7, col8 = st.columns(2)
+    is_corresponding_is_USFF_by_year = tables['is_corresponding_is_USFF_by_year']
 
-yesyes_bypublisher = yesyes.groupby(['Publisher', 'PubYear']).count().reset_index()[['Publisher', 'PubYear', 'DOI']]
-yesyes_bypublisher.sort_values(by='DOI', ascending=False, inplace=True)
-yesyes_bypublisher.to_csv(f'data/{institution_name_nospaces}/{institution_name_nospaces}_yesyes_groupbypublisher.csv', index=False)
+    fig5 = cached_figure(lambda: charts.flag_by_year(is_corresponding_is_USFF_by_year, 'is_corresponding_is_USFF'), 'fig5')
+    fig6 = cached_figure(lambda: charts.flag_by_year(is_corresponding_is_USFF_by_year, 'is_corresponding_is_USFF', percent=True), 'fig6')
 
-# #fig7 = px.bar(yesyes_bypublisher, x='PubYear', y='DOI', color='Publisher', text_auto=True, barmode='stack')
-# fig7 = px.pie(yesyes_bypublisher, values='DOI', names='Publisher', facet_col='PubYear')
-# fig7.update_traces(textposition='inside', textinfo='percent+label+value')#, rotation=-75)
-# #fig7.update_xaxes(type='category', categoryorder='category ascending')
-# fig7.update_layout(width=1900, showlegend=False)
 
-# st.plotly_chart(fig7)
+    with col5:
+        st.subheader('Raw Counts')
+        st.plotly_chart(fig5)
 
-st.subheader('By Count')
+    with col6:
+        st.subheader('Percentages')
+        st.plotly_chart(fig6)
 
-fig8 = px.bar(yesyes_bypublisher, x='PubYear', y='DOI', color='Publisher', text_auto=True)
-fig8.update_xaxes(type='category', categoryorder='category ascending')
-st.plotly_chart(fig8)
 
-#st.write(len(get_50_percent(yesyes_bypublisher[yesyes_bypublisher['PubYear']==2023])))
-#st.write(f"Publishers :{yesyes_bypublisher.groupby(['PubYear'])['Publisher'].count()}")
 
+@section('Publishers')
+def publisher_section(tables, institution_name):
+    st.markdown('---')
+    st.header(f"Further Details on the 'yes_yes' Section")
+    st.subheader(f'Look at {institution_name} Corresponding Authored & Federally Funded Documents')
+    st.subheader('Breakdown by **:red[Publisher]**')
+    #col7, col8 = st.columns(2)
 
+    yesyes_bypublisher = tables['yesyes_bypublisher']
 
-st.subheader('By Percent')
-fig9 = px.histogram(yesyes_bypublisher, x='PubYear', y='DOI', color='Publisher', text_auto=True, barnorm='percent')
-fig9.update_xaxes(type='category', categoryorder='category ascending')
-#fig9.update_yaxes(type='category', categoryorder='total ascending')
-fig9.update_traces(texttemplate = "%{value:.2f}%")
-fig9.update_layout(height=650, width=1600)
-fig9.update_yaxes(tick0=0, dtick=10)
-#fig9.add_shape(type="line", x0=min('PubYear'), x1=max('PubYear'), y0=50, y1=50, line=dict(color="Purple", width=10, dash="dot")),
-fig9.add_hline(y=25, line_width=2, line_color='purple', line_dash='dot')
-fig9.add_hline(y=50, line_width=2, line_color='purple', line_dash='dot')
-fig9.add_hline(y=75, line_width=2, line_color='purple', line_dash='dot')
-st.plotly_chart(fig9)
+    # #fig7 = px.bar(yesyes_bypublisher, x='PubYear', y='DOI', color='Publisher', text_auto=True, barmode='stack')
+    # fig7 = px.pie(yesyes_bypublisher, values='DOI', names='Publisher', facet_col='PubYear')
+    # fig7.update_traces(textposition='inside', textinfo='percent+label+value')#, rotation=-75)
+    # #fig7.update_xaxes(type='category', categoryorder='category ascending')
+    # fig7.update_layout(width=1900, showlegend=False)
 
+    # st.plotly_chart(fig7)
 
-publisher_50percent_point = yesyes_bypublisher.groupby(['PubYear'])['Publisher'].count().reset_index()
-publisher_50percent_point.loc[:, '50percent_point'] = publisher_50percent_point.loc[ :, 'PubYear'].apply(get_50_percent_passyear)
-publisher_50percent_point.rename(columns={'Publisher': 'NumPublishers'}, inplace=True)
-publisher_50percent_point
+    st.subheader('By Count')
 
+    fig8 = cached_figure(lambda: charts.publisher_by_year(yesyes_bypublisher), 'fig8')
+    st.plotly_chart(fig8)
 
+    #st.write(len(get_50_percent(yesyes_bypublisher[yesyes_bypublisher['PubYear']==2023])))
+    #st.write(f"Publishers :{yesyes_bypublisher.groupby(['PubYear'])['Publisher'].count()}")
 
-st.markdown('---')
-#st.header('Further Details on the `yes_yes` Documents (Corresponding & Federally Funded)')
-st.subheader('Breakdown by **:red[Journal Title]**')
 
-yesyes_byjournaltitle = yesyes.groupby(['Source title', 'PubYear', 'Publisher']).count().reset_index()[['Source title', 'PubYear', 'Publisher', 'DOI']]
-yesyes_byjournaltitle.sort_values(by='PubYear', ascending=True, inplace=True)
-yesyes_byjournaltitle.to_csv(f'data/{institution_name_nospaces}/{institution_name_nospaces}_yesyes_groupbyjournaltitle.csv', index=False)
 
-top20_toggle = st.radio('', ['Show only the Top 20 journal titles', 'Show up to 2,000 journal titles'], label_visibility = 'collapsed')
-if top20_toggle=='Show only the Top 20 journal titles':
-    maxallowed = 20
-else:
-    maxallowed = 2000
+    st.subheader('By Percent')
+    # percent of each year's yes_yes output, with dotted lines at 25/50/75%
+    fig9 = cached_figure(lambda: charts.publisher_by_year(yesyes_bypublisher, percent=True), 'fig9')
+    st.plotly_chart(fig9)
+
 
-fig10 = px.histogram(yesyes_byjournaltitle, x='Source title', y='DOI', color='PubYear', text_auto='True',
-                    title='Top Journal Titles with Corresponding Authored USFF Outputs',
-                    category_orders={'PubYear': [2016, 2017, 2018, 2019, 2020, 2021, 2022, 2023]})
-fig10.update_xaxes(categoryorder='total descending', maxallowed=maxallowed)
-fig10.update_layout(height=1000, showlegend=True, legend_traceorder='reversed')
+    # number of publishers that make up 50% of each year's output, see aggregates.concentration_points
+    publisher_50percent_point = tables['publisher_50percent_point']
+    st.write(publisher_50percent_point)
 
-journal_totals = yesyes_byjournaltitle.groupby('Source title')['DOI'].sum().sort_values(ascending=False).reset_index()
-journal_totals[0:maxallowed]
-# Add total count labels on top of each stacked bar chart
-# This didn't work for some reason, the plot ended up squished way over to the right with a big blank area??
-# fig10.add_trace(go.Scatter(
-#     x=journal_totals[0:maxallowed]['Source title'],
-#     y=journal_totals[0:maxallowed]['DOI'],
-#     text=journal_totals[0:maxallowed]['DOI'],
-#     mode='text',
-#     textposition='top center',
-#     textfont=dict(size=12,),
-#     showlegend=False
-# ))
 
-st.plotly_chart(fig10)
 
+# The funder section sits inside this one because fig12/fig14 follow the toggle too
+@section('Journal titles', interactive=True)
+def journal_section(tables, funder_index):
+    st.markdown('---')
+    #st.header('Further Details on the `yes_yes` Documents (Corresponding & Federally Funded)')
+    st.subheader('Breakdown by **:red[Journal Title]**')
 
-yesyes_byjournal_and_OA = yesyes.groupby(['Source title', 'PubYear', 'Open Access']).count().reset_index()[['Source title', 'PubYear', 'Open Access', 'DOI']]
-yesyes_byjournal_and_OA.sort_values(by='DOI', ascending=False, inplace=True)
+    yesyes_byjournaltitle = tables['yesyes_byjournaltitle']
 
-fig13 = px.bar(yesyes_byjournal_and_OA, x='Source title', y='DOI', color='Open Access',
-            category_orders={'Open Access': ["Closed", "All OA; Gold", "All OA; Bronze", "All OA; Green", "All OA; Hybrid"]},
-            color_discrete_map={
-                "Closed": "#AB63FA",
-                "All OA; Gold": "gold",
-                "All OA; Bronze": "#636EFA",
-                "All OA; Green": "#2CA02C",
-                "All OA; Hybrid": "#EF553B"},
-            #pattern_shape='Open Access'
-           title = 'Top Journal Titles with Corresponding Authored USFF Outputs and Open Access status<br>Zoom or pan to see more' )
+    top20_toggle = st.radio('', ['Show only the Top 20 journal titles', 'Show up to 2,000 journal titles'], label_visibility = 'collapsed')
+    if top20_toggle=='Show only the Top 20 journal titles':
+        maxallowed = 20
+    else:
+        maxallowed = 2000
 
-fig13.update_xaxes(categoryorder = 'total descending', maxallowed=maxallowed)
-fig13.update_layout(height=1000, showlegend=True, legend_traceorder='reversed')
-#fig13.update_traces(dict(marker_line_width=0))
+    # only the top maxallowed titles get sent to the browser
+    fig10 = cached_figure(lambda: charts.journals(yesyes_byjournaltitle, 'PubYear', maxallowed,
+                                                  'Top Journal Titles with Corresponding Authored USFF Outputs'), 'fig10', maxallowed)
 
-st.plotly_chart(fig13)
+    journal_totals = charts.totals(yesyes_byjournaltitle, 'Source title')
+    st.write(journal_totals[0:maxallowed])
+    # Add total count labels on top of each stacked bar chart
+    # This didn't work for some reason, the plot ended up squished way over to the right with a big blank area??
+    # fig10.add_trace(go.Scatter(
+    #     x=journal_totals[0:maxallowed]['Source title'],
+    #     y=journal_totals[0:maxallowed]['DOI'],
+    #     text=journal_totals[0:maxallowed]['DOI'],
+    #     mode='text',
+    #     textposition='top center',
+    #     textfont=dict(size=12,),
+    #     showlegend=False
+    # ))
 
+    st.plotly_chart(fig10)
 
 
+    yesyes_byjournal_and_OA = tables['yesyes_byjournal_and_OA']
 
-st.markdown('---')
-#st.header('Further Details on the `yes_yes` Documents (Corresponding & Federally Funded)')
-st.subheader('Breakdown by **:red[Funder]**')
-
-# Load funder name conversion dictionary into memory, don't want to keep re-opening it every time
-import csv
-
-lookup_data = {}
-
-# def load_lookupfile(file_path):
-#     with open(file_path, 'r') as f:
-#         reader = csv.reader(f)
-#         for line in reader:
-#             print(line)
-#             key, value = (line[0], line[1])
-#             lookup_data[key] = value
-
-def lookup(key):
-    return lookup_data.get(key)
-
-@st.cache_data
-def load_dict_from_csv(file_path, key_column, value_column):
-    """Loads a dictionary from an csv file.
-
-    Args:
-        file_path: The path to the file.
-        key_column: The name of the column to use as keys in the dictionary.
-        value_column: The name of the column to use as values in the dictionary.
-
-    Returns:
-        A dictionary created from the data.
-    """
-
-    dict_df = pd.read_csv(file_path)
-    lookup_data = dict(zip(dict_df[key_column], dict_df[value_column]))
-    return lookup_data
-
-#load_lookupfile('Dimensions_USFFGroup_mapped_to_RORs_and_2ndlevel_parent_onlytwocolumns.csv')
-lookup_data = load_dict_from_csv('Dimensions_USFFGroup_mapped_to_RORs_and_2ndlevel_parent_onlytwocolumns.csv', 'Name_no_parentheses', 'parentName')
-
-def convert_Funder_string_to_Parent(funder_string: str) -> list:
-    """
-    Pass in Dimensions `Funder` cell on each row
-    Comes in as long string of funder names
-    Want to isolate the US federal funders and use the conversion file to get the 2nd level Parent name
-    
-    
-    Input: Funder cell (Directorate for Computer & Information Science & Engineering; National Cancer Institute)
-    Output: List of Parent names (['US National Science Foundation', 'Health and Human Services'])
-    """
-    #print(f'Checking {funder_string=}')
-    
-    result = []
-    
-    parts = funder_string.split('; ')  # when only one passed in, no semicolon, still returns it
-    
-    for i in range(len(parts)):
-        #print(parts[i])
-        #print(lookup(parts[i]))
-        if lookup(parts[i]):
-            #print(f'{parts[i]}, parent is {lookup(parts[i])}')
-            result.append(lookup(parts[i]))
-    
-    return(result)
-
-def dedupe_Funder_names(multiple_funder_string: list) -> list:
-    '''
-    Takes in a list of normalized 2nd level funder names
-    Converts to set to keep only unique ones
-    Converts back to list
-    Returns list of only the unique ones
-    '''
-    newset = set(multiple_funder_string)
-    return(list(newset))
-
-# Match Funder strings to the names of the 2nd level Parents (under US Govt.)
-# Use `yesyes`, which is the full DOI-level data
-yesyes.loc[yesyes['Funder'].notna(), 'ParentAgencyWithDuplicates'] = yesyes.loc[yesyes['Funder'].notna(),'Funder'].apply(convert_Funder_string_to_Parent)
-# then you have to dedupe the 2nd level Parents. If it acknowledges USDA twice and NASA three times, just keep one of each.
-yesyes.loc[yesyes['Funder'].notna(), 'ParentAgency'] = yesyes.loc[yesyes['Funder'].notna(),'ParentAgencyWithDuplicates'].apply(dedupe_Funder_names)
-yesyes.to_csv(f'data/{institution_name_nospaces}/{institution_name_nospaces}_yesyes_with_funderDuplicates.csv', index=False)
-
-# Explode to repeat DOIs that have multiple funders
-funders_exploded = yesyes.explode('ParentAgency')
-funders_exploded.to_csv(f'data/{institution_name_nospaces}/{institution_name_nospaces}_DOIlevel_funders_exploded.csv', index=False)
-
-# any time you have a df name that contains _by, it's from a groupby. Summary data in there
-yesyes_byfunderexploded = funders_exploded.groupby(['ParentAgency', 'PubYear']).count().reset_index()[['ParentAgency', 'PubYear', 'DOI']]
-yesyes_byfunderexploded.sort_values(by='PubYear', ascending=True, inplace=True)
-yesyes_byfunderexploded["PubYear"] = yesyes_byfunderexploded["PubYear"].astype(str)
-yesyes_byfunderexploded.to_csv(f'data/{institution_name_nospaces}/{institution_name_nospaces}_yesyes_groupbyfunderexploded.csv', index=False)
-
-fig11 = px.bar(yesyes_byfunderexploded, x='ParentAgency', y='DOI', color='PubYear', text_auto='True',
-                     title='Top Funding Agencies with Corresponding Authored USFF Outputs<br>Papers that acknowledge more than one funder are included here multiple times',
-                     category_orders={'PubYear': [2016, 2017, 2018, 2019, 2020, 2021, 2022, 2023]})
-fig11.update_xaxes(categoryorder='total descending')
-fig11.update_layout(height=1000, showlegend=True, legend_traceorder='reversed')
-
-funder_totals = yesyes_byfunderexploded.groupby('ParentAgency')['DOI'].sum().sort_values(ascending=False).reset_index()
-#funder_totals
-
-# Add total count labels on top of each stacked bar chart
-# https://stackoverflow.com/questions/72761553/plotly-how-to-display-the-total-sum-of-the-values-at-top-of-a-stacked-bar-chart
-fig11.add_trace(go.Scatter(
-    x=funder_totals['ParentAgency'],
-    y=funder_totals['DOI'],
-    text=funder_totals['DOI'],
-    mode='text',
-    textposition='top center',
-    textfont=dict(size=12,),
-    showlegend=False
-))
-
-st.plotly_chart(fig11)
-
-
-# Let the user choose a funder to look at more closely. First list all the possible funders found in this set
-list_of_funders = funder_totals['ParentAgency']
-chosen_funder = st.selectbox('Choose a funder to look at their publications in more detail', list_of_funders)
-
-# funders_exploded is still DOI-level
-chosen_funder_DOIlevel = funders_exploded[funders_exploded['ParentAgency']==chosen_funder]
-chosen_funder_DOIlevel[['DOI', 'Source title', 'Publisher', 'PubYear', 'Title', 'ISSN', 'Open Access', 'Authors', 'Authors (Raw Affiliation)', 'Corresponding Authors', 'Authors Affiliations', 'Research Organizations - standardized', 'Funder', 'ParentAgency']]
-
-chosenfunder_byjournaltitle = chosen_funder_DOIlevel.groupby(['Source title', 'PubYear', 'Publisher']).count().reset_index()[['Source title', 'PubYear', 'Publisher', 'DOI']]
-#chosenfunder_byjournaltitle.astype({'PubYear':'int32'}).dtypes
-chosenfunder_byjournaltitle.sort_values(by='PubYear', ascending=True, inplace=True)
-chosenfunder_byjournaltitle.to_csv(f'data/{institution_name_nospaces}/{institution_name_nospaces}_yesyes_chosenfunder_groupbyjournaltitle.csv', index=False)
-
-fig12 = px.bar(chosenfunder_byjournaltitle, x='Source title', y='DOI', color='PubYear', text_auto='True',
-                     title=f'Top Journal Titles with Corresponding Author from {institution_name}<br>and Funding from {chosen_funder}, by Year',
-                     category_orders={'PubYear': [2016, 2017, 2018, 2019, 2020, 2021, 2022, 2023]})
-fig12.update_xaxes(categoryorder='total descending', maxallowed=maxallowed)
-fig12.update_layout(height=1000, showlegend=True, legend_traceorder='reversed')
-st.plotly_chart(fig12)
-
-
-
-chosenfunder_byjournal_and_OA = chosen_funder_DOIlevel.groupby(['Source title', 'PubYear', 'Open Access']).count().reset_index()[['Source title', 'PubYear', 'Open Access', 'DOI']]
-chosenfunder_byjournal_and_OA.sort_values(by='PubYear', ascending=True, inplace=True)
-chosenfunder_byjournal_and_OA.to_csv(f'data/{institution_name_nospaces}/{institution_name_nospaces}_yesyes_chosenfunder_groupbyjournal_and_OA.csv', index=False)
-
-fig14 = px.bar(chosenfunder_byjournal_and_OA, x='Source title', y='DOI', color='Open Access',
-            category_orders={'Open Access': ["Closed", "All OA; Gold", "All OA; Bronze", "All OA; Green", "All OA; Hybrid"]},
-            color_discrete_map={
-                "Closed": "#AB63FA",
-                "All OA; Gold": "gold",
-                "All OA; Bronze": "#636EFA",
-                "All OA; Green": "#2CA02C",
-                "All OA; Hybrid": "#EF553B"},
-            #pattern_shape='Open Access'
-           title = f'Top Journal Titles with Corresponding Author from {institution_name}<br>and Funding from {chosen_funder}, by Open Access status' )
-
-fig14.update_xaxes(categoryorder = 'total descending', maxallowed=maxallowed)
-fig14.update_layout(height=1000, showlegend=True, legend_traceorder='reversed')
-#fig13.update_traces(dict(marker_line_width=0))
-
-st.plotly_chart(fig14)
\ No newline at end of file
+    fig13 = cached_figure(lambda: charts.journals(yesyes_byjournal_and_OA, 'Open Access', maxallowed,
+                                                  'Top Journal Titles with Corresponding Authored USFF Outputs and Open Access status<br>Zoom or pan to see more',
+                                                  text=False), 'fig13', maxallowed)
+
+    st.plotly_chart(fig13)
+
+    funder_section(tables, funder_index, maxallowed)
+
+
+
+
+@section('Funders')
+def funder_section(tables, funder_index, maxallowed):
+    st.markdown('---')
+    #st.header('Further Details on the `yes_yes` Documents (Corresponding & Federally Funded)')
+    st.subheader('Breakdown by **:red[Funder]**')
+
+    # Funder strings were already matched to the 2nd level Parents (under US Govt.) in load_profile, see funders.py
+    # `yesyes` and `funders_exploded` are the full DOI-level data
+
+    # any time you have a df name that contains _by, it's from a groupby. Summary data in there
+    yesyes_byfunderexploded = tables['yesyes_byfunderexploded']
+
+    # total count labels on top of each stacked bar are part of charts.funders
+    fig11 = cached_figure(lambda: charts.funders(yesyes_byfunderexploded,
+                                                 'Top Funding Agencies with Corresponding Authored USFF Outputs<br>Papers that acknowledge more than one funder are included here multiple times'), 'fig11')
+
+    funder_totals = charts.totals(yesyes_byfunderexploded, 'ParentAgency')
+    #funder_totals
+
+    st.plotly_chart(fig11)
+
+
+    # Let the user choose a funder to look at more closely. First list all the possible funders found in this set
+    list_of_funders = funder_totals['ParentAgency']
+
+    chosen_funder_section(list_of_funders, funder_index, tables['chosenfunder_byjournaltitle'], tables['chosenfunder_byjournal_and_OA'], maxallowed)
+
+
+
+# Only this part reruns when a different funder is picked, the charts above stay as they are
+@section('Chosen funder', interactive=True)
+def chosen_funder_section(list_of_funders, funder_index, funder_tables_byjournaltitle, funder_tables_byjournal_and_OA, maxallowed):
+    chosen_funder = st.selectbox('Choose a funder to look at their publications in more detail', list_of_funders)
+
+    # funder_index knows where each ParentAgency's rows are in funders_exploded (still DOI-level)
+    # the wide text columns (Title, Authors...) aren't kept in memory, read them for just this funder's DOIs
+    chosen_funder_DOIlevel = load_detail(merged_file, source_hash, chosen_funder, profile_filter, profile_filter.apply(funder_index.rows(funders_exploded, chosen_funder)))
+    st.dataframe(chosen_funder_DOIlevel[[c for c in ['DOI', 'Source title', 'Publisher', 'PubYear', 'Title', 'ISSN', 'Open Access', 'Authors', 'Authors (Raw Affiliation)', 'Corresponding Authors', 'Authors Affiliations', 'Research Organizations - standardized', 'Funder', 'ParentAgency'] if c in chosen_funder_DOIlevel]])
+
+    # the exported files are the unfiltered tables, whatever the sidebar says
+    chosenfunder_byjournaltitle = funder_tables_byjournaltitle.get(chosen_funder, EMPTY_FUNDER_TABLE)
+    exporter.submit(full_tables['chosenfunder_byjournaltitle'].get(chosen_funder, EMPTY_FUNDER_TABLE),
+                    f'{export_prefix}_yesyes_chosenfunder_groupbyjournaltitle', key=(source_hash, chosen_funder))
+
+    fig12 = cached_figure(lambda: charts.journals(chosenfunder_byjournaltitle, 'PubYear', maxallowed,
+                                                  f'Top Journal Titles with Corresponding Author from {institution_name}<br>and Funding from {chosen_funder}, by Year'),
+                          'fig12', chosen_funder, maxallowed)
+    st.plotly_chart(fig12)
+
+
+
+    chosenfunder_byjournal_and_OA = funder_tables_byjournal_and_OA.get(chosen_funder, EMPTY_FUNDER_TABLE)
+    exporter.submit(full_tables['chosenfunder_byjournal_and_OA'].get(chosen_funder, EMPTY_FUNDER_TABLE),
+                    f'{export_prefix}_yesyes_chosenfunder_groupbyjournal_and_OA', key=(source_hash, chosen_funder))
+
+    fig14 = cached_figure(lambda: charts.journals(chosenfunder_byjournal_and_OA, 'Open Access', maxallowed,
+                                                  f'Top Journal Titles with Corresponding Author from {institution_name}<br>and Funding from {chosen_funder}, by Open Access status',
+                                                  text=False),
+                          'fig14', chosen_funder, maxallowed)
+
+    st.plotly_chart(fig14)
+
+
+EMPTY_FUNDER_TABLE = pd.DataFrame(columns=['Source title', 'PubYear', 'Publisher', 'Open Access', 'DOI'])
+funder_index = shared_cache.get_or_build(('funder_index', merged_file, source_hash), lambda: FunderIndex(funders_exploded), group=('funder_index', merged_file))
+
+by_year_section(tables, institution_name)
+publisher_section(tables, institution_name)
+journal_section(tables, funder_index)
+
+
+
+# Warm start: once the first page is drawn, load every other institution into the shared cache in the background
+# (once per server process), so switching institution doesn't wait on the parquet load and groupbys.
+# warm_start.py, run when the server starts, has already written their cubes to disk
+def warm_institutions():
+   for name in INSTITUTION_IDS:
+      # stop before crowding out what visitors are actually looking at
+      if shared_cache.stats()['MB'].sum() * 2**20 > shared_cache.max_bytes / 2:
+         return
+      link = find_merged_file(data_dir(name))
+      if link is None:
+         continue
+      try:
+         link_hash = file_hash(link)
+         _, _, warm_cube = load_profile(link, link_hash, announce=False)
+         load_tables(link, link_hash, warm_cube)
+      except Exception:
+         logging.getLogger(__name__).exception(f'Warm start failed for {name}')
+
+@st.cache_resource
+def warm_start():
+   thread = threading.Thread(target=warm_institutions, name='warm_start', daemon=True)
+   thread.start()
+   return thread
+
+warm_start()
+
+
+if debug_trace is not None:
+    exporter.wait()     # so the CSV writes make it into the trace
+    debug_trace.finish()
+    trace_file = debug_trace.write()
+    with st.sidebar:
+        st.subheader('Debug')
+        st.write(f'Full run: **{debug_trace.seconds * 1000:.0f} ms**, trace written to `{trace_file}`')
+        st.dataframe(debug_trace.to_frame().drop(columns=['started']), hide_index=True)
+        st.write(f'Shared cache: {shared_cache.hits} hits, {shared_cache.misses} misses')
+        st.dataframe(shared_cache.stats(), hide_index=True)
+        st.write('Funder matching, every file matched by this server process:')
+        st.dataframe(load_funder_mapping_shared().stats_frame(), hide_index=True)
\ No newline at end of file
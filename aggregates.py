@@ -0,0 +1,172 @@
+# Aggregation layer for the IOI Publishing Profiler
+# Collapse the DOI-level `merged` file into one small count cube per institution,
+# then every chart/table is a cheap groupby over the cube instead of the raw frame
+
+import hashlib
+import os
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from funders import explode_parent_agency
+from instrumentation import timed_stage
+from schema import flag_labels
+
+# every dimension a chart or table slices by
+CUBE_DIMENSIONS = ['PubYear', 'is_corresponding', 'is_USFF', 'Publisher', 'Source title', 'Open Access', 'ParentAgency']
+
+
+@lru_cache(maxsize=64)
+def _hash_file_contents(path, size, mtime_ns):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def file_hash(path):
+    '''
+    Input: path to the merged parquet file
+    Returns: sha1 hex digest of the file contents
+    Only re-reads the file when its size or modification time changes
+    '''
+    stat = os.stat(path)
+    return _hash_file_contents(path, stat.st_size, stat.st_mtime_ns)
+
+
+def build_cube(merged: pd.DataFrame, parent_agency: pd.Series = None) -> pd.DataFrame:
+    '''
+    Input: DOI-level merged dataframe (unique index), and optionally the exploded `ParentAgency` Series
+           from funders.map_parent_agencies / add_parent_agency, whose index points into merged
+    Returns: one row per combination of CUBE_DIMENSIONS with two counts
+        DOI         number of publications, each one counted once
+        DOI_funder  number of publication/ParentAgency pairs, so papers that acknowledge
+                    more than one funder are counted once per funder (same as exploding)
+    '''
+    frame = merged[CUBE_DIMENSIONS[:-1] + ['DOI']].assign(is_corresponding=flag_labels(merged['is_corresponding']),
+                                                          is_USFF=flag_labels(merged['is_USFF']))
+    if parent_agency is not None:
+        frame = explode_parent_agency(frame, parent_agency)
+    else:
+        frame = frame.assign(ParentAgency=None)
+
+    has_doi = frame['DOI'].notna().to_numpy()
+    # only the first exploded row of each publication counts towards the plain DOI count
+    frame = frame.assign(DOI=(has_doi & ~frame.index.duplicated()).astype('int64'),
+                         DOI_funder=has_doi.astype('int64'))
+
+    cube = frame.groupby(CUBE_DIMENSIONS, dropna=False, observed=True, sort=False)[['DOI', 'DOI_funder']].sum().reset_index()
+    return cube
+
+
+def merge_cubes(cubes: list) -> pd.DataFrame:
+    '''
+    Input: cubes built from separate chunks of one merged file (chunk indexes must not overlap)
+    Returns: a single cube, same counts as build_cube on all the rows at once
+    '''
+    cube = pd.concat(cubes, ignore_index=True)
+    return cube.groupby(CUBE_DIMENSIONS, dropna=False, observed=True, sort=False)[['DOI', 'DOI_funder']].sum().reset_index()
+
+
+def _plain(table: pd.DataFrame) -> pd.DataFrame:
+    '''categorical columns back to plain labels, so later groupbys on the small tables only see observed values'''
+    categorical = [c for c in table.columns if table[c].dtype == 'category']
+    return table.astype({c: object for c in categorical}) if categorical else table
+
+
+def yes_yes(cube: pd.DataFrame) -> pd.DataFrame:
+    '''Corresponding authored and US federally funded part of the cube'''
+    return cube[(cube['is_corresponding'] == 'yes') & (cube['is_USFF'] == 'yes')]
+
+
+def counts_by_year(cube: pd.DataFrame, color: str) -> pd.DataFrame:
+    '''
+    Input: cube, flag column to split each year by
+           ('is_corresponding', 'is_USFF' or the combined 'is_corresponding_is_USFF')
+    Returns: PubYear, color, DOI
+    '''
+    if color == 'is_corresponding_is_USFF':
+        cube = cube.assign(is_corresponding_is_USFF=cube['is_corresponding'].astype(str) + '_' + cube['is_USFF'].astype(str))
+    return _plain(cube.groupby(['PubYear', color], observed=True)['DOI'].sum().reset_index())
+
+
+def by_publisher(cube: pd.DataFrame) -> pd.DataFrame:
+    '''yes_yes counts by Publisher and PubYear, largest first'''
+    table = _plain(yes_yes(cube).groupby(['Publisher', 'PubYear'], observed=True)['DOI'].sum().reset_index())
+    return table.sort_values(by='DOI', ascending=False)
+
+
+def by_journal_title(cube: pd.DataFrame) -> pd.DataFrame:
+    '''yes_yes counts by Source title, PubYear and Publisher, sorted by year'''
+    table = _plain(yes_yes(cube).groupby(['Source title', 'PubYear', 'Publisher'], observed=True)['DOI'].sum().reset_index())
+    return table.sort_values(by='PubYear', ascending=True)
+
+
+def by_journal_and_OA(cube: pd.DataFrame) -> pd.DataFrame:
+    '''yes_yes counts by Source title, PubYear and Open Access status, largest first'''
+    table = _plain(yes_yes(cube).groupby(['Source title', 'PubYear', 'Open Access'], observed=True)['DOI'].sum().reset_index())
+    return table.sort_values(by='DOI', ascending=False)
+
+
+def by_funder(cube: pd.DataFrame) -> pd.DataFrame:
+    '''yes_yes counts by ParentAgency and PubYear, papers with several funders counted once per funder'''
+    table = yes_yes(cube).groupby(['ParentAgency', 'PubYear'], observed=True)['DOI_funder'].sum().reset_index()
+    table = table.rename(columns={'DOI_funder': 'DOI'}).sort_values(by='PubYear', ascending=True)
+    table['ParentAgency'] = table['ParentAgency'].astype(str)
+    table['PubYear'] = table['PubYear'].astype(str)
+    return table
+
+
+def funder_tables(cube: pd.DataFrame, columns: list) -> dict:
+    '''
+    Input: cube, columns to group by (e.g. ['Source title', 'PubYear', 'Publisher'])
+    Returns: dict of ParentAgency -> yes_yes counts for publications acknowledging that funder, sorted by year
+    One groupby for every funder, so switching funders in the app is just a dict lookup
+    '''
+    table = yes_yes(cube).groupby(['ParentAgency'] + columns, observed=True)['DOI_funder'].sum().reset_index()
+    table = _plain(table).rename(columns={'DOI_funder': 'DOI'}).sort_values(by='PubYear', ascending=True, kind='stable')
+    return {funder: group.drop(columns=['ParentAgency']) for funder, group in table.groupby('ParentAgency', sort=False)}
+
+
+# started from get_50_percent_passyear (base code from StackOverflow user Maarten Fabré), which did one year per call
+def concentration_points(table: pd.DataFrame, item='Publisher', group='PubYear', value='DOI', pcts=(50,), count_name=None) -> pd.DataFrame:
+    '''
+    How many items (publishers, journals, funders) it takes to reach pct of each group's (year's) output,
+    for every group and every threshold in one pass
+
+    Input: aggregated table with item, group and value columns (by_publisher, by_journal_title, by_funder...)
+           pcts, list of percentages (e.g. [25, 50, 75, 90])
+    Returns: group, count_name (number of items, defaults to Num<item>s), and a <pct>percent_point column per pct
+    '''
+    # biggest first within each group, then the running share of the group total
+    ordered = table.sort_values([group, value], ascending=[True, False])
+    grouped = ordered.groupby(group, observed=True, sort=True)
+    share = grouped[value].cumsum() / grouped[value].transform('sum')
+
+    result = grouped[item].count().rename(count_name or f'Num{item}s').reset_index()
+    n_rows = grouped.size().to_numpy()
+    for pct in pcts:
+        # items still under pct, then go one more (but never past the last one)
+        below = (share < pct / 100).groupby(ordered[group], observed=True, sort=True).sum().to_numpy()
+        result[f'{pct}percent_point'] = np.minimum(below + 1, n_rows)
+    return result
+
+
+@timed_stage('groupbys')
+def profile_tables(cube: pd.DataFrame) -> dict:
+    '''Every aggregated table the dashboard shows for one institution, by name'''
+    yesyes_bypublisher = by_publisher(cube)
+    return {
+        'is_corresponding_by_year': counts_by_year(cube, 'is_corresponding'),
+        'is_USFF_by_year': counts_by_year(cube, 'is_USFF'),
+        'is_corresponding_is_USFF_by_year': counts_by_year(cube, 'is_corresponding_is_USFF'),
+        'yesyes_bypublisher': yesyes_bypublisher,
+        'publisher_50percent_point': concentration_points(yesyes_bypublisher, item='Publisher', pcts=[50]),
+        'yesyes_byjournaltitle': by_journal_title(cube),
+        'yesyes_byjournal_and_OA': by_journal_and_OA(cube),
+        'yesyes_byfunderexploded': by_funder(cube),
+        'chosenfunder_byjournaltitle': funder_tables(cube, ['Source title', 'PubYear', 'Publisher']),
+        'chosenfunder_byjournal_and_OA': funder_tables(cube, ['Source title', 'PubYear', 'Open Access']),
+    }
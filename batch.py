@@ -0,0 +1,119 @@
+# IOI Publishing Profiler - batch mode
+# Runs the whole pipeline (load, funder matching, cube, exports) for many institutions in parallel, no Streamlit needed
+#
+#   python batch.py                                   every institution in institutions.py
+#   python batch.py --institution Yale I32971472 data/Yale --institution MIT I63966007 data/MIT
+#   python batch.py --config institutions.csv          csv with institution,openalex_id,data_dir columns
+#   python batch.py --enrich --mailto you@school.edu   fill is_corresponding from OpenAlex first (see enrich.py)
+#   python batch.py --trace                           also write a stage timing trace per institution to data/traces
+#
+# Writes each institution's cube next to its merged file, and puts every institution's yearly counts
+# in the summary store (summary_store.py) for the comparison page
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+from tqdm import tqdm
+
+from aggregates import file_hash
+from enrich import OpenAlexClient, enrich_corresponding
+from exports import EXPORT_FORMATS, ExportStage
+from institutions import INSTITUTION_IDS, data_dir
+from instrumentation import Trace, stage
+from pipeline import find_merged_file, export_profile, profile_merged_file
+from schema import write_merged
+from summary_store import SUMMARY_FILE, summarize, update_summary
+
+
+def run_institution(institution_name, openalex_id, institution_dir, fmt='csv', enrich=False, mailto=None, trace=False):
+    '''
+    Full pipeline for one institution, runs in a worker process
+    enrich=True refreshes is_corresponding from OpenAlex and rewrites the merged file first
+    trace=True writes the stage timings and memory (see instrumentation.py) to data/traces
+    Returns: the institution's summary store rows, or None if there's no merged file
+    '''
+    merged_file = find_merged_file(institution_dir)
+    if merged_file is None:
+        return None
+    if not trace:
+        return _run_institution(institution_name, openalex_id, institution_dir, merged_file, fmt, enrich, mailto)
+    with Trace(f'batch {institution_name}', memory=True, metadata={'merged_file': merged_file}) as run_trace:
+        result = _run_institution(institution_name, openalex_id, institution_dir, merged_file, fmt, enrich, mailto)
+    run_trace.write()
+    return result
+
+
+def _run_institution(institution_name, openalex_id, institution_dir, merged_file, fmt, enrich, mailto):
+    if enrich:
+        # every column, the wide text ones have to survive the rewrite, and it's written back in the format it came in
+        with stage('enrich'):
+            merged = enrich_corresponding(pd.read_parquet(merged_file), openalex_id, client=OpenAlexClient(mailto=mailto), show_progress=False)
+            write_merged(merged, merged_file)
+
+    source_hash = file_hash(merged_file)
+    yesyes, funders_exploded, cube = profile_merged_file(merged_file, source_hash=source_hash, save=True)
+
+    exporter = ExportStage(fmt=fmt)
+    export_prefix = os.path.join(institution_dir, os.path.basename(os.path.normpath(institution_dir)))
+    export_profile(exporter, export_prefix, yesyes, funders_exploded, cube, key=source_hash, merged_file=merged_file)
+    exporter.shutdown()
+
+    return summarize(cube, institution_name, openalex_id, source_hash)
+
+
+def run_batch(institutions, workers=None, fmt='csv', enrich=False, mailto=None, trace=False, summary_file=SUMMARY_FILE):
+    '''
+    Input: list of (institution name, OpenAlex ID, data directory)
+    Returns: summary store rows of every institution that had a merged file, also written to summary_file
+    '''
+    summaries = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_institution, *institution, fmt, enrich, mailto, trace): institution[0] for institution in institutions}
+        for future in tqdm(as_completed(futures), total=len(futures), desc='Institutions'):
+            result = future.result()
+            if result is None:
+                tqdm.write(f'No merged file found for {futures[future]}, skipped')
+            else:
+                summaries.append(result)
+
+    if not summaries:
+        return None
+    update_summary(summaries, summary_file)
+    return pd.concat(summaries, ignore_index=True)
+
+
+def read_institutions(args):
+    '''Institutions from --institution / --config, or everything in institutions.py'''
+    institutions = [tuple(institution) for institution in args.institution or []]
+    if args.config:
+        config = pd.read_csv(args.config, dtype=str)
+        institutions += list(config[['institution', 'openalex_id', 'data_dir']].itertuples(index=False, name=None))
+    if not institutions:
+        institutions = [(name, openalex_id, data_dir(name)) for name, openalex_id in INSTITUTION_IDS.items()]
+    return institutions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the IOI Publishing Profiler pipeline for many institutions')
+    parser.add_argument('--institution', nargs=3, action='append', metavar=('NAME', 'OPENALEX_ID', 'DATA_DIR'))
+    parser.add_argument('--config', help='csv with institution, openalex_id and data_dir columns')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, defaults to the number of cores')
+    parser.add_argument('--format', default='csv', choices=sorted(EXPORT_FORMATS), help='format of the side outputs')
+    parser.add_argument('--summary-file', default=SUMMARY_FILE, help='summary store the yearly counts go to')
+    parser.add_argument('--enrich', action='store_true', help='fill is_corresponding from OpenAlex before profiling')
+    parser.add_argument('--mailto', help='contact email for the OpenAlex polite pool')
+    parser.add_argument('--trace', action='store_true', help='write stage timings and memory per institution to data/traces')
+    args = parser.parse_args()
+
+    summary = run_batch(read_institutions(args), workers=args.workers, fmt=args.format, enrich=args.enrich,
+                        mailto=args.mailto, trace=args.trace, summary_file=args.summary_file)
+    if summary is None:
+        print('No merged files found, nothing written')
+    else:
+        print(f"{summary['institution'].nunique()} institutions' yearly counts written to {args.summary_file}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# Benchmark: Plotly JSON size and build time, px.histogram on DOI-level rows vs the pre-binned bars in charts.py
+# Run from the repo root:  python benchmarks/bench_figure_payload.py --rows 200000
+
+import argparse
+import os
+import sys
+from time import perf_counter
+
+import plotly.express as px
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import charts
+from aggregates import build_cube, profile_tables
+from schema import flag_labels, is_yes_yes, to_compact
+from synthetic import synthetic_merged
+
+
+def histogram_figures(merged, maxallowed):
+    '''The old way, DOI-level rows straight into px.histogram'''
+    merged = merged.assign(is_corresponding=flag_labels(merged['is_corresponding']), is_USFF=flag_labels(merged['is_USFF']))
+    yesyes = merged[is_yes_yes(merged)]
+    figs = {}
+    for name, flag, barnorm in [('fig', 'is_corresponding', None), ('fig2', 'is_corresponding', 'percent'),
+                                ('fig3', 'is_USFF', None), ('fig4', 'is_USFF', 'percent')]:
+        figs[name] = px.histogram(merged, x='PubYear', color=flag, barnorm=barnorm, text_auto=True)
+    figs['fig9'] = px.histogram(yesyes, x='PubYear', color='Publisher', barnorm='percent', text_auto=True)
+    for name, color in [('fig10', 'PubYear'), ('fig13', 'Open Access')]:
+        figs[name] = px.histogram(yesyes, x='Source title', color=color)
+        figs[name].update_xaxes(categoryorder='total descending', maxallowed=maxallowed)
+    return figs
+
+
+def prebinned_figures(tables, maxallowed):
+    return {
+        'fig': charts.flag_by_year(tables['is_corresponding_by_year'], 'is_corresponding'),
+        'fig2': charts.flag_by_year(tables['is_corresponding_by_year'], 'is_corresponding', percent=True),
+        'fig3': charts.flag_by_year(tables['is_USFF_by_year'], 'is_USFF'),
+        'fig4': charts.flag_by_year(tables['is_USFF_by_year'], 'is_USFF', percent=True),
+        'fig9': charts.publisher_by_year(tables['yesyes_bypublisher'], percent=True),
+        'fig10': charts.journals(tables['yesyes_byjournaltitle'], 'PubYear', maxallowed, ''),
+        'fig13': charts.journals(tables['yesyes_byjournal_and_OA'], 'Open Access', maxallowed, '', text=False),
+    }
+
+
+def timed(run):
+    start = perf_counter()
+    figs = run()
+    sizes = {name: charts.payload_size(fig) for name, fig in figs.items()}
+    return perf_counter() - start, sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--maxallowed', type=int, default=20, help='20 or 2000, the top20 toggle')
+    args = parser.parse_args()
+
+    merged = to_compact(synthetic_merged(args.rows, detail=False))
+    start = perf_counter()
+    tables = profile_tables(build_cube(merged))
+    table_time = perf_counter() - start
+
+    old_time, old_sizes = timed(lambda: histogram_figures(merged, args.maxallowed))
+    new_time, new_sizes = timed(lambda: prebinned_figures(tables, args.maxallowed))
+
+    print(f'{args.rows:,} DOI rows, top {args.maxallowed} journals')
+    print(f'  {"figure":>6} {"histogram KB":>13} {"pre-binned KB":>14}')
+    for name in old_sizes:
+        print(f'  {name:>6} {old_sizes[name] / 1024:13,.1f} {new_sizes[name] / 1024:14,.1f}')
+    old_total, new_total = sum(old_sizes.values()), sum(new_sizes.values())
+    print(f'  {"total":>6} {old_total / 1024:13,.1f} {new_total / 1024:14,.1f}   ({old_total / new_total:.0f}x smaller)')
+    print(f'  build + serialize: histogram {old_time:.2f} s, pre-binned {new_time:.2f} s (+ {table_time:.2f} s for the cube and tables, shared with the rest of the app)')
+
+
+if __name__ == '__main__':
+    main()
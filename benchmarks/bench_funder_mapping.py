@@ -0,0 +1,57 @@
+# Benchmark: per-row .apply funder mapping vs the batch engine in funders.py
+# Run from the repo root:  python benchmarks/bench_funder_mapping.py --rows 1000000
+
+import argparse
+import os
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from funders import (FUNDER_LOOKUP_FILE, convert_Funder_string_to_Parent, dedupe_Funder_names,
+                     load_dict_from_csv, load_funder_mapping, map_parent_agencies)
+from synthetic import synthetic_funders
+
+
+def apply_path(funder, lookup_data):
+    has_funder = funder.notna()
+    parents = funder[has_funder].apply(convert_Funder_string_to_Parent, lookup_data=lookup_data)
+    parents = parents.apply(dedupe_Funder_names)
+    return parents, funder[has_funder].to_frame().assign(ParentAgency=parents).explode('ParentAgency')
+
+
+def batch_path(funder, mapping):
+    return map_parent_agencies(funder, mapping)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    lookup_file = os.path.join(os.path.dirname(__file__), '..', FUNDER_LOOKUP_FILE)
+    lookup_data = load_dict_from_csv(lookup_file, 'Name_no_parentheses', 'parentName')
+    mapping = load_funder_mapping(lookup_file)
+    funder = synthetic_funders(args.rows)
+
+    # same Parents per row, the apply path's set() ordering is arbitrary so compare as sets
+    apply_lists, _ = apply_path(funder, lookup_data)
+    batch_lists, _ = batch_path(funder, mapping)
+    assert (apply_lists.apply(frozenset) == batch_lists[funder.notna()].apply(frozenset)).all()
+
+    print(f'{args.rows:,} Funder rows, best of {args.repeat}')
+    timings = {}
+    for name, run in [('apply', lambda: apply_path(funder, lookup_data)), ('batch', lambda: batch_path(funder, mapping))]:
+        best = float('inf')
+        for _ in range(args.repeat):
+            start = perf_counter()
+            run()
+            best = min(best, perf_counter() - start)
+        timings[name] = best
+        print(f'  {name:>6}: {best:8.3f} s')
+    print(f'  speedup: {timings["apply"] / timings["batch"]:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# Benchmark: exact-name dict lookup vs the FunderMatcher engine (normalized names + word trie) in funders.py
+# on Funder text with the variants real Dimensions cells have: acronyms in parentheses, case and spacing,
+# names run together with commas, and known names inside other funders' names
+# Run from the repo root:  python benchmarks/bench_funder_matching.py --rows 1000000 --variants 0.2
+
+import argparse
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from funders import (FUNDER_LOOKUP_FILE, FunderMatcher, convert_Funder_string_to_Parent, dedupe_Funder_names,
+                     load_dict_from_csv, load_funder_mapping, map_parent_agencies)
+from synthetic import synthetic_funders
+
+ACRONYMS = ['NSF', 'NIH', 'NCI', 'DOE', 'USDA', 'NASA', 'DOD', 'NIST']
+
+
+def variant_funders(rows, seed=0, share=0.2):
+    '''
+    synthetic_funders(rows) with about `share` of the names rewritten the ways real Funder cells differ
+    from the mapping file, so exact matching misses them
+    '''
+    rng = np.random.default_rng(seed + 1)
+    funder = synthetic_funders(rows, seed)
+    rewrites = [
+        lambda name: f'{name} ({rng.choice(ACRONYMS)})',
+        lambda name: name.upper(),
+        lambda name: name.lower().replace(' ', '  '),
+        lambda name: f'The {name}',
+        lambda name: f'Swiss {name}',                   # a different funder, has to stay unmatched
+    ]
+
+    def rewrite(cell):
+        names = cell.split('; ')
+        for i in np.flatnonzero(rng.random(len(names)) < share):
+            names[i] = rewrites[rng.integers(len(rewrites))](names[i])
+        if len(names) > 1 and rng.random() < share:
+            names[:2] = [', '.join(names[:2])]          # two names in one part
+        return '; '.join(names)
+
+    # rewrite the unique strings, like the real data the same cells repeat across DOIs
+    codes, uniques = pd.factorize(funder)
+    rewritten = np.array([rewrite(cell) for cell in uniques], dtype=object)
+    return pd.Series(np.where(codes >= 0, rewritten[codes], None), name='Funder')
+
+
+def dict_path(funder, lookup_data):
+    has_funder = funder.notna()
+    parents = funder[has_funder].apply(convert_Funder_string_to_Parent, lookup_data=lookup_data)
+    return parents.apply(dedupe_Funder_names)
+
+
+def matched_rows(lists):
+    return int(lists.dropna().map(len).gt(0).sum())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--variants', type=float, default=0.2, help='share of funder names rewritten')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    lookup_file = os.path.join(os.path.dirname(__file__), '..', FUNDER_LOOKUP_FILE)
+    lookup_data = load_dict_from_csv(lookup_file, 'Name_no_parentheses', 'parentName')
+    mapping = load_funder_mapping(lookup_file)
+
+    start = perf_counter()
+    FunderMatcher(mapping)
+    print(f'engine built from {len(mapping)} mapping names in {(perf_counter() - start) * 1000:.1f} ms')
+
+    # clean names: the engine gives exactly what the dict gives
+    clean = synthetic_funders(min(args.rows, 100_000))
+    clean_lists, _ = map_parent_agencies(clean, FunderMatcher(mapping))
+    assert (dict_path(clean, lookup_data).apply(frozenset) == clean_lists[clean.notna()].apply(frozenset)).all()
+
+    # variant names: the engine finds everything the dict does, and more
+    funder = variant_funders(args.rows, share=args.variants)
+    exact_lists = dict_path(funder, lookup_data)
+    matcher = FunderMatcher(mapping)
+    fuzzy_lists, _ = map_parent_agencies(funder, matcher)
+    fuzzy_lists = fuzzy_lists[funder.notna()]
+    assert all(set(e) <= set(f) for e, f in zip(exact_lists, fuzzy_lists))
+
+    print(f'{args.rows:,} Funder rows, {args.variants:.0%} of names rewritten, best of {args.repeat}')
+    print(f'  rows with a Parent: dict {matched_rows(exact_lists):,}, engine {matched_rows(fuzzy_lists):,}')
+    print(matcher.stats_frame().to_string(index=False))
+
+    timings = {}
+    runs = [('dict', lambda: dict_path(funder, lookup_data)),
+            ('exact', lambda: map_parent_agencies(funder, mapping)),
+            ('engine', lambda: map_parent_agencies(funder, FunderMatcher(mapping))),     # fresh engine, nothing resolved yet
+            ('warm', lambda: map_parent_agencies(funder, matcher))]     # shared engine that has seen these parts (the app's case)
+    for name, run in runs:
+        best = float('inf')
+        for _ in range(args.repeat):
+            start = perf_counter()
+            run()
+            best = min(best, perf_counter() - start)
+        timings[name] = best
+        print(f'  {name:>6}: {best:8.3f} s')
+    print(f'  engine vs dict: {timings["dict"] / timings["engine"]:.1f}x fresh, {timings["dict"] / timings["warm"]:.1f}x warm')
+
+
+if __name__ == '__main__':
+    main()
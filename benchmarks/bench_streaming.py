@@ -0,0 +1,82 @@
+# Benchmark: in-memory build_profile vs stream_profile (batches of rows) on a synthetic merged file
+# Checks both give the same yesyes, funders_exploded, cube and dashboard tables, then compares time and peak memory
+# Run from the repo root:  python benchmarks/bench_streaming.py --rows 1000000 --batch-size 100000
+
+import argparse
+import os
+import sys
+import tempfile
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from aggregates import CUBE_DIMENSIONS, profile_tables
+from funders import FUNDER_LOOKUP_FILE, load_funder_mapping
+from instrumentation import Trace, stage
+from pipeline import build_profile, load_merged, stream_profile
+from synthetic import write_synthetic
+
+
+def normalized(table):
+    '''table with plain string labels, sorted on every column, so row order and category dtypes don't matter'''
+    table = table.astype({c: str for c in table.columns if c not in ('DOI', 'DOI_funder')})
+    return table.sort_values(list(table.columns), ignore_index=True)
+
+
+def assert_same_cube(cube, s_cube):
+    '''same counts for the same dimensions, whatever order the rows are in'''
+    columns = CUBE_DIMENSIONS + ['DOI', 'DOI_funder']
+    pd.testing.assert_frame_equal(normalized(cube[columns]), normalized(s_cube[columns]))
+
+
+def assert_same_profile(expected, streamed):
+    '''
+    Input: (yesyes, funders_exploded, cube) from build_profile and from stream_profile
+    Also used by tests/test_streaming.py, so the benchmark and the tests check the same thing
+    '''
+    yesyes, funders_exploded, cube = expected
+    s_yesyes, s_funders_exploded, s_cube = streamed
+    pd.testing.assert_frame_equal(yesyes, s_yesyes, check_categorical=False)
+    pd.testing.assert_frame_equal(funders_exploded, s_funders_exploded, check_categorical=False)
+    assert_same_cube(cube, s_cube)
+
+    tables, s_tables = profile_tables(cube), profile_tables(s_cube)
+    for name, table in tables.items():
+        if isinstance(table, dict):
+            pd.testing.assert_index_equal(pd.Index(sorted(table)), pd.Index(sorted(s_tables[name])), obj=name)
+            for funder in table:
+                pd.testing.assert_frame_equal(normalized(table[funder]), normalized(s_tables[name][funder]))
+        else:
+            pd.testing.assert_frame_equal(normalized(table), normalized(s_tables[name]), obj=name)
+
+
+def measured(name, run):
+    '''Returns: (result, StageRecord with seconds and peak_mb)'''
+    with Trace(name, memory=True):
+        with stage(name) as record:
+            result = run()
+    return result, record
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--batch-size', type=int, default=100_000)
+    args = parser.parse_args()
+
+    mapping = load_funder_mapping(os.path.join(os.path.dirname(__file__), '..', FUNDER_LOOKUP_FILE))
+    with tempfile.TemporaryDirectory() as directory:
+        merged_file = write_synthetic(os.path.join(directory, 'bench_merged_small.parquet'), args.rows)
+
+        expected, in_memory = measured('in-memory', lambda: build_profile(load_merged(merged_file), mapping))
+        streamed, streaming = measured('streaming', lambda: stream_profile(merged_file, mapping, batch_size=args.batch_size))
+
+    assert_same_profile(expected, streamed)
+    print(f'{args.rows:,} rows, batches of {args.batch_size:,}: streaming results identical to in-memory')
+    for record in (in_memory, streaming):
+        print(f'  {record.name:>10}: {record.seconds:7.2f} s, peak {record.peak_mb:8.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
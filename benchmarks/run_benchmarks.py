@@ -0,0 +1,141 @@
+# Benchmark suite: times every pipeline stage on synthetic merged files and checks them against stored baselines
+# Run from the repo root:
+#   python benchmarks/run_benchmarks.py                         10k, 100k and 1M rows, compared with baselines.json
+#   python benchmarks/run_benchmarks.py --rows 5000000          one size
+#   python benchmarks/run_benchmarks.py --save                  record these timings as the new baselines
+#
+# Exits with 1 when a stage got slower than its baseline by more than --tolerance
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+from time import perf_counter
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import charts
+from aggregates import build_cube, profile_tables
+from bench_figure_payload import prebinned_figures
+from exports import ExportStage
+from funders import FUNDER_LOOKUP_FILE, add_parent_agency, explode_parent_agency, load_funder_matcher
+from pipeline import export_profile, load_merged
+from schema import is_yes_yes
+from synthetic import write_synthetic
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'baselines.json')
+DEFAULT_ROWS = [10_000, 100_000, 1_000_000]
+DATA_DIR = os.path.join(tempfile.gettempdir(), 'publishing_profiler_bench')
+MIN_SLOWDOWN = 0.25     # seconds, anything less is mostly noise on the small sizes
+
+
+def run_stages(merged_file, mapping, export_dir):
+    '''
+    One pass through the pipeline the way the app does it
+    Returns: dict of stage -> seconds
+    '''
+    timings = {}
+
+    def stage(name, run):
+        start = perf_counter()
+        result = run()
+        timings[name] = perf_counter() - start
+        return result
+
+    merged = stage('load', lambda: load_merged(merged_file))
+    yesyes = stage('yes_yes filter', lambda: merged[is_yes_yes(merged)])
+    yesyes, parent_agency = stage('funder mapping', lambda: add_parent_agency(yesyes, mapping))
+    funders_exploded = stage('explode', lambda: explode_parent_agency(yesyes, parent_agency))
+    cube = stage('cube', lambda: build_cube(merged, parent_agency))
+    tables = stage('groupbys', lambda: profile_tables(cube))
+
+    def exports():
+        exporter = ExportStage()
+        export_profile(exporter, os.path.join(export_dir, 'bench'), yesyes, funders_exploded, cube, merged_file=merged_file)
+        exporter.shutdown()
+    stage('exports', exports)
+
+    def figures():
+        figs = prebinned_figures(tables, 20)
+        figs['fig11'] = charts.funders(tables['yesyes_byfunderexploded'], '')
+        return [charts.payload_size(fig) for fig in figs.values()]
+    stage('figure build', figures)
+    return timings
+
+
+def benchmark(rows, repeat, mapping):
+    '''Best of repeat runs of every stage for a synthetic file of rows rows (generated once, then reused)'''
+    merged_file = os.path.join(DATA_DIR, f'synthetic_{rows}.parquet')
+    if not os.path.exists(merged_file):
+        print(f'Generating {rows:,} rows...')
+        write_synthetic(merged_file, rows)
+
+    best = {}
+    for _ in range(repeat):
+        # fresh export directory every time, otherwise the export manifest skips the writes
+        with tempfile.TemporaryDirectory() as export_dir:
+            for name, seconds in run_stages(merged_file, mapping, export_dir).items():
+                best[name] = min(seconds, best.get(name, float('inf')))
+    return best
+
+
+def read_baselines(path=BASELINE_FILE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except OSError:
+        return {'results': {}}
+
+
+def regressions(results, baselines, tolerance):
+    '''List of (rows, stage, baseline seconds, seconds) for stages slower than baseline * (1 + tolerance) (and by MIN_SLOWDOWN)'''
+    slower = []
+    for rows, timings in results.items():
+        for name, seconds in timings.items():
+            baseline = baselines['results'].get(rows, {}).get(name)
+            if baseline is not None and seconds > baseline * (1 + tolerance) and seconds - baseline > MIN_SLOWDOWN:
+                slower.append((rows, name, baseline, seconds))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time every pipeline stage on synthetic merged files')
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown vs the baseline, 0.25 = 25%%')
+    parser.add_argument('--baselines', default=BASELINE_FILE)
+    parser.add_argument('--save', action='store_true', help='store these timings as the baselines')
+    args = parser.parse_args()
+
+    mapping = load_funder_matcher(os.path.join(os.path.dirname(__file__), '..', FUNDER_LOOKUP_FILE))
+    results = {str(rows): benchmark(rows, args.repeat, mapping) for rows in args.rows}
+
+    table = pd.DataFrame(results)
+    table.columns = [f'{int(rows):,} rows' for rows in table.columns]
+    print(table.round(3).to_string())
+
+    baselines = read_baselines(args.baselines)
+    if args.save:
+        baselines['results'].update({rows: {name: round(seconds, 4) for name, seconds in timings.items()}
+                                     for rows, timings in results.items()})
+        baselines['machine'] = {'python': platform.python_version(), 'pandas': pd.__version__,
+                                'platform': platform.platform(), 'cpus': os.cpu_count()}
+        with open(args.baselines, 'w') as f:
+            json.dump(baselines, f, indent=1, sort_keys=True)
+        print(f'Baselines saved to {args.baselines}')
+        return
+
+    slower = regressions(results, baselines, args.tolerance)
+    for rows, name, baseline, seconds in slower:
+        print(f'REGRESSION {int(rows):,} rows, {name}: {baseline:.3f} s -> {seconds:.3f} s')
+    if slower:
+        sys.exit(1)
+    print('No regressions against', args.baselines)
+
+
+if __name__ == '__main__':
+    main()
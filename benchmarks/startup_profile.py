@@ -0,0 +1,83 @@
+# Startup profile of the Streamlit app: what its imports cost, and how long the first and second render take
+# Imports are timed with python -X importtime in a fresh interpreter, renders with Streamlit's AppTest
+# Run from the repo root:  python benchmarks/startup_profile.py --top 15 --render
+
+import argparse
+import ast
+import os
+import subprocess
+import sys
+from time import perf_counter
+
+import pandas as pd
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+APP = 'IOI_publishing_profiler_plotOnly.py'
+
+
+def app_imports(path=os.path.join(ROOT, APP)) -> list:
+    '''the app's top-level import statements, as source lines'''
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    return [ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+
+
+def import_times(statements) -> pd.DataFrame:
+    '''
+    Runs the statements in a fresh interpreter under -X importtime
+    Returns: module, self_ms, cumulative_ms, depth (0 = imported by the statements themselves), slowest first
+    '''
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', '\n'.join(statements)],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        # import time:       412 |       1203 |   pandas
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        rows.append((name.strip(), int(self_us) / 1000, int(cumulative_us) / 1000, depth))
+    times = pd.DataFrame(rows, columns=['module', 'self_ms', 'cumulative_ms', 'depth'])
+    return times.sort_values('cumulative_ms', ascending=False, ignore_index=True)
+
+
+def render_times(institution=None) -> list:
+    '''seconds for the first (cold) and second (cached) run of the app, optionally with one institution picked'''
+    from streamlit.testing.v1 import AppTest
+
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    at = AppTest.from_file(APP, default_timeout=600)
+    seconds = []
+    for _ in range(2):
+        start = perf_counter()
+        at.run()
+        if institution is not None:
+            at.selectbox[0].set_value(institution)
+            at.run()
+        seconds.append(perf_counter() - start)
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--top', type=int, default=15, help='slowest top-level imports to show')
+    parser.add_argument('--render', action='store_true', help='also time the first and second run of the app')
+    parser.add_argument('--institution', help='institution to pick in the render runs, defaults to the first one')
+    args = parser.parse_args()
+
+    statements = app_imports()
+    times = import_times(statements)
+    top_level = times[times['depth'] == 0]
+    print(f'{APP} imports: {top_level["cumulative_ms"].sum():.0f} ms in a fresh interpreter')
+    print(top_level.head(args.top)[['module', 'cumulative_ms', 'self_ms']].to_string(index=False, float_format='%.1f'))
+
+    if args.render:
+        first, second = render_times(args.institution)
+        print(f'first render {first:.2f} s, second render {second:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# Synthetic merged files for the benchmarks, same columns as a real <institution>_merged_small.parquet
+# (Dimensions export + is_USFF + is_corresponding), from 10k to a few million rows
+#
+#   python benchmarks/synthetic.py --rows 1000000 data/bench/bench_merged_small.parquet
+
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from funders import FUNDER_LOOKUP_FILE
+from schema import DETAIL_COLUMNS
+
+YEARS = list(range(2016, 2024))
+OA_STATUSES = ['Closed', 'All OA; Gold', 'All OA; Bronze', 'All OA; Green', 'All OA; Hybrid']
+
+# a few non-US funders so not every part matches, like real Dimensions Funder cells
+OTHER_FUNDERS = ['Wellcome Trust', 'European Research Council', 'National Natural Science Foundation of China',
+                 'Deutsche Forschungsgemeinschaft', 'Natural Sciences and Engineering Research Council']
+
+
+def _zipf_pick(rng, n, size):
+    '''size draws from range(n), the first few far more likely than the rest'''
+    popularity = 1 / np.arange(1, n + 1)
+    return rng.choice(n, size=size, p=popularity / popularity.sum())
+
+
+def synthetic_funders(rows, seed=0):
+    '''
+    Input: number of rows
+    Returns: Series of Dimensions-like Funder strings, 0-5 names joined with '; ', about 1/4 of rows empty
+    Names are drawn Zipf-style, a handful of big funders (NSF, NIH institutes) show up on most papers
+    '''
+    rng = np.random.default_rng(seed)
+    names = np.array(OTHER_FUNDERS + pd.read_csv(os.path.join(os.path.dirname(__file__), '..', FUNDER_LOOKUP_FILE))['Name_no_parentheses'].tolist())
+    rng.shuffle(names)
+    counts = rng.choice(6, size=rows, p=[0.25, 0.3, 0.2, 0.12, 0.08, 0.05])
+    picks = names[_zipf_pick(rng, len(names), counts.sum())]
+    cells = np.split(picks, np.cumsum(counts)[:-1])
+    return pd.Series(['; '.join(cell) if len(cell) else None for cell in cells], name='Funder')
+
+
+def synthetic_merged(rows, seed=0, journals=2500, publishers=150, detail=True):
+    '''
+    Input: number of rows
+    Returns: merged dataframe shaped like the real file, 'yes'/'no'/'unknown' flags and the combined flag columns included
+    Journals and publishers are Zipf-distributed like real output, detail=False leaves out the wide text columns
+    '''
+    rng = np.random.default_rng(seed)
+    merged = pd.DataFrame({
+        'DOI': [f'10.1000/x{i}' for i in range(rows)],
+        'PubYear': rng.choice(YEARS, size=rows),
+        'Publisher': np.array([f'Publisher {p}' for p in range(publishers)])[_zipf_pick(rng, publishers, rows)],
+        'Source title': np.array([f'Journal {j}' for j in range(journals)])[_zipf_pick(rng, journals, rows)],
+        'Open Access': rng.choice(OA_STATUSES, size=rows),
+        'is_corresponding': rng.choice(['yes', 'no', 'unknown'], size=rows, p=[0.35, 0.5, 0.15]),
+        'is_USFF': rng.choice(['yes', 'no'], size=rows, p=[0.4, 0.6]),
+        'Funder': synthetic_funders(rows, seed),
+    })
+    merged['is_corresponding_is_USFF'] = merged['is_corresponding'] + '_' + merged['is_USFF']
+    merged['is_USFF_is_corresponding'] = merged['is_USFF'] + '_' + merged['is_corresponding']
+    if detail:
+        # long-ish text drawn from a pool, real titles/author lists are unique but this keeps big runs in memory
+        pool = np.array([' '.join(rng.choice(['alpha', 'beta', 'gamma', 'delta', 'Smith, J.', 'Iowa State University'], size=12))
+                         for _ in range(1000)])
+        for column in DETAIL_COLUMNS:
+            merged[column] = pool[rng.integers(len(pool), size=rows)]
+    return merged
+
+
+def write_synthetic(path, rows, seed=0):
+    '''Writes synthetic_merged(rows) to path as parquet, the way the real merged files are stored'''
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    synthetic_merged(rows, seed).to_parquet(path, index=False)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic merged file')
+    parser.add_argument('output')
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    write_synthetic(args.output, args.rows, args.seed)
+    print(f'Wrote {args.rows:,} rows to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+# Chart building for the IOI Publishing Profiler
+# px.histogram on DOI-level rows put every row into the Plotly JSON and let the browser do the binning.
+# Here the bars come straight from the aggregated tables (aggregates.profile_tables): one bar per (x, color) pair,
+# with the percentages for the 100% stacked charts worked out in pandas instead of with barnorm='percent'.
+# Journal charts are cut to the top `maxallowed` titles before plotting, instead of sending all ~2,000 and
+# hiding the rest with the axis' maxallowed
+
+import pandas as pd
+import plotly.graph_objects as go
+
+FLAG_COLORS = {'yes': 'blue', 'no': 'salmon', 'unknown': 'lightgray'}
+FLAG_ORDER = ['yes', 'no']
+COMBINED_FLAG_COLORS = {'yes_yes': 'blue', 'yes_no': 'lightblue', 'no_yes': 'salmon', 'no_no': 'lightgray'}
+COMBINED_FLAG_ORDER = ['yes_yes', 'yes_no', 'no_yes', 'no_no']
+OA_COLORS = {'Closed': '#AB63FA', 'All OA; Gold': 'gold', 'All OA; Bronze': '#636EFA',
+             'All OA; Green': '#2CA02C', 'All OA; Hybrid': '#EF553B'}
+OA_ORDER = ['Closed', 'All OA; Gold', 'All OA; Bronze', 'All OA; Green', 'All OA; Hybrid']
+
+PERCENT_DECIMALS = 4    # plenty for hover text, and keeps the JSON short
+
+
+def totals(table: pd.DataFrame, item: str, value='DOI') -> pd.DataFrame:
+    '''item, value - summed over everything else, largest first'''
+    return table.groupby(item)[value].sum().sort_values(ascending=False).reset_index()
+
+
+def stacked_bars(table: pd.DataFrame, x: str, color: str, value='DOI', percent=False, x_order=None,
+                 color_order=(), color_map=None, texttemplate=None) -> list:
+    '''
+    Input: aggregated table with x, color and value columns
+           percent=True turns each x's bars into shares of that x's total (what barnorm='percent' did in the browser)
+           x_order keeps only those x values, in that order
+           color_order puts those colors first (bottom of the stack), the rest follow in order of appearance like px does
+    Returns: list of go.Bar traces, one per color, leaving out the (x, color) pairs with no records
+    '''
+    wide = table.pivot_table(index=x, columns=color, values=value, aggfunc='sum', observed=True)
+    if x_order is not None:
+        wide = wide.reindex(x_order)
+    if percent:
+        wide = (wide.div(wide.sum(axis=1), axis=0) * 100).round(PERCENT_DECIMALS)
+
+    present = set(wide.columns)
+    colors = [c for c in color_order if c in present]
+    colors += [c for c in pd.unique(table[color]) if c in present and c not in colors]
+
+    color_map = color_map or {}
+    traces = []
+    for c in colors:
+        bars = wide[c].dropna()
+        traces.append(go.Bar(x=bars.index.tolist(), y=bars.tolist(), name=str(c), legendgroup=str(c),
+                             marker_color=color_map.get(c), texttemplate=texttemplate,
+                             hovertemplate=f'{x}=%{{x}}<br>{color}={c}<br>{"percent" if percent else value}=%{{y}}<extra></extra>'))
+    return traces
+
+
+def _figure(traces, legend_title, x_title, y_title, **layout):
+    fig = go.Figure(data=traces)
+    fig.update_layout(barmode='relative', legend_title_text=legend_title, legend_traceorder='reversed', **layout)
+    fig.update_xaxes(title_text=x_title)
+    fig.update_yaxes(title_text=y_title)
+    return fig
+
+
+def flag_by_year(table: pd.DataFrame, flag: str, percent=False) -> go.Figure:
+    '''
+    Input: counts_by_year table for flag ('is_corresponding', 'is_USFF' or 'is_corresponding_is_USFF')
+    Returns: bars by PubYear split by the flag, raw counts or percentages (fig - fig6)
+    '''
+    combined = flag == 'is_corresponding_is_USFF'
+    traces = stacked_bars(table, 'PubYear', flag, percent=percent,
+                          color_order=COMBINED_FLAG_ORDER if combined else FLAG_ORDER,
+                          color_map=COMBINED_FLAG_COLORS if combined else FLAG_COLORS,
+                          texttemplate='%{y:.2f}' if percent else '%{y}')
+    fig = _figure(traces, flag, 'PubYear', 'percent' if percent else 'count')
+    fig.update_xaxes(type='category', categoryorder='category ascending')
+    return fig
+
+
+def publisher_by_year(table: pd.DataFrame, percent=False) -> go.Figure:
+    '''
+    Input: yesyes_bypublisher table
+    Returns: bars by PubYear split by Publisher, raw counts (fig8) or percent of each year with 25/50/75% lines (fig9)
+    '''
+    traces = stacked_bars(table, 'PubYear', 'Publisher', percent=percent,
+                          texttemplate='%{y:.2f}%' if percent else '%{y}')
+    fig = _figure(traces, 'Publisher', 'PubYear', 'percent' if percent else 'DOI')
+    fig.update_xaxes(type='category', categoryorder='category ascending')
+    if percent:
+        fig.update_layout(height=650, width=1600)
+        fig.update_yaxes(tick0=0, dtick=10)
+        for y in (25, 50, 75):
+            fig.add_hline(y=y, line_width=2, line_color='purple', line_dash='dot')
+    return fig
+
+
+def journals(table: pd.DataFrame, color: str, maxallowed: int, title: str, text=True) -> go.Figure:
+    '''
+    Input: journal table (yesyes_byjournaltitle, yesyes_byjournal_and_OA or a chosen funder's version),
+           color ('PubYear' or 'Open Access'), how many titles to show
+    Returns: bars for the top maxallowed Source titles by total, largest first (fig10, fig12 - fig14)
+    '''
+    top = totals(table, 'Source title')['Source title'][:maxallowed]
+    by_OA = color == 'Open Access'
+    traces = stacked_bars(table[table['Source title'].isin(top)], 'Source title', color, x_order=top,
+                          color_order=OA_ORDER if by_OA else sorted(table[color].unique()),
+                          color_map=OA_COLORS if by_OA else None, texttemplate='%{y}' if text else None)
+    fig = _figure(traces, color, 'Source title', 'DOI', title=title, height=1000, showlegend=True)
+    fig.update_xaxes(type='category', categoryorder='array', categoryarray=top.tolist())
+    return fig
+
+
+def funders(table: pd.DataFrame, title: str) -> go.Figure:
+    '''
+    Input: yesyes_byfunderexploded table
+    Returns: bars by ParentAgency split by PubYear, largest first, with the total on top of each bar (fig11)
+    '''
+    funder_totals = totals(table, 'ParentAgency')
+    traces = stacked_bars(table, 'ParentAgency', 'PubYear', x_order=funder_totals['ParentAgency'],
+                          color_order=sorted(table['PubYear'].unique()), texttemplate='%{y}')
+    # https://stackoverflow.com/questions/72761553/plotly-how-to-display-the-total-sum-of-the-values-at-top-of-a-stacked-bar-chart
+    traces.append(go.Scatter(x=funder_totals['ParentAgency'].tolist(), y=funder_totals['DOI'].tolist(),
+                             text=funder_totals['DOI'].tolist(), mode='text', textposition='top center',
+                             textfont=dict(size=12), showlegend=False))
+    fig = _figure(traces, 'PubYear', 'ParentAgency', 'DOI', title=title, height=1000, showlegend=True)
+    fig.update_xaxes(type='category', categoryorder='array', categoryarray=funder_totals['ParentAgency'].tolist())
+    return fig
+
+
+def share_by_year(table: pd.DataFrame, title: str) -> go.Figure:
+    '''
+    Input: summary_store.shares table (institution, PubYear, DOI, total, percent)
+    Returns: bars by PubYear, one per institution side by side, height is the percent of that year's records
+    '''
+    traces = []
+    for institution, rows in table.groupby('institution', sort=True):
+        traces.append(go.Bar(x=rows['PubYear'].tolist(), y=rows['percent'].tolist(), name=str(institution),
+                             customdata=rows[['DOI', 'total']].to_numpy().tolist(), texttemplate='%{y:.1f}',
+                             hovertemplate=f'{institution}<br>PubYear=%{{x}}<br>%{{y:.2f}}% (%{{customdata[0]}} of %{{customdata[1]}})<extra></extra>'))
+    fig = go.Figure(data=traces)
+    fig.update_layout(barmode='group', title=title, legend_title_text='institution')
+    fig.update_xaxes(title_text='PubYear', type='category', categoryorder='category ascending')
+    fig.update_yaxes(title_text='percent', range=[0, 100])
+    return fig
+
+
+def payload_size(fig) -> int:
+    '''Bytes of Plotly JSON the browser gets for fig'''
+    return len(fig.to_json(validate=False))
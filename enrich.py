@@ -0,0 +1,225 @@
+# OpenAlex enrichment - fill `is_corresponding` from OpenAlex authorships
+# Works are fetched by DOI in batches (filter=doi:a|b|c), a few requests at a time, politely rate limited,
+# and every answer is kept in a SQLite cache so re-runs only ask OpenAlex about new DOIs
+#
+#   python enrich.py data/IowaStateUniversity/IowaStateUniversity_merged_small.parquet --institution-id I173911158 --mailto you@school.edu
+
+import argparse
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+import requests
+from tqdm import tqdm
+
+from schema import flag_labels, to_compact, write_merged
+
+OPENALEX_WORKS_URL = 'https://api.openalex.org/works'
+CACHE_FILE = 'data/openalex_cache.sqlite'
+BATCH_SIZE = 50                 # DOIs per request, OpenAlex allows up to 100 OR'd values in one filter
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+def normalize_doi(doi):
+    '''10.1000/ABC, doi:10.1000/abc and https://doi.org/10.1000/abc all become 10.1000/abc'''
+    doi = str(doi).strip().lower()
+    for prefix in ('https://doi.org/', 'http://doi.org/', 'doi:'):
+        if doi.startswith(prefix):
+            doi = doi[len(prefix):]
+    return doi
+
+
+class ResponseCache:
+    '''
+    SQLite cache of what OpenAlex said about each DOI
+    The record is the list of OpenAlex institution IDs of the corresponding authors,
+    None when OpenAlex doesn't know the DOI (so we don't keep asking)
+    '''
+
+    def __init__(self, path=CACHE_FILE):
+        self._db = sqlite3.connect(path, timeout=60)    # batch.py workers may share the file
+        self._db.execute('CREATE TABLE IF NOT EXISTS works (doi TEXT PRIMARY KEY, record TEXT, fetched_at REAL)')
+
+    def get_many(self, dois):
+        found = {}
+        dois = list(dois)
+        for start in range(0, len(dois), 500):
+            chunk = dois[start:start + 500]
+            rows = self._db.execute(f'SELECT doi, record FROM works WHERE doi IN ({",".join("?" * len(chunk))})', chunk)
+            found.update((doi, json.loads(record)) for doi, record in rows)
+        return found
+
+    def put_many(self, records):
+        now = time.time()
+        with self._db:
+            self._db.executemany('INSERT OR REPLACE INTO works VALUES (?, ?, ?)',
+                                 [(doi, json.dumps(record), now) for doi, record in records.items()])
+
+    def close(self):
+        self._db.close()
+
+
+class RateLimiter:
+    '''Spaces request starts at least 1/requests_per_second apart'''
+
+    def __init__(self, requests_per_second):
+        self._interval = 1 / requests_per_second
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            if self._next > now:
+                await asyncio.sleep(self._next - now)
+            self._next = max(now, self._next) + self._interval
+
+
+def corresponding_institutions(work):
+    '''
+    Input: one OpenAlex work (needs `authorships`)
+    Returns: sorted OpenAlex institution IDs (I173911158) of the corresponding authors, [] if none are flagged
+    '''
+    ids = set()
+    for authorship in work.get('authorships') or []:
+        if authorship.get('is_corresponding'):
+            ids.update((institution.get('id') or '').rsplit('/', 1)[-1] for institution in authorship.get('institutions') or [])
+    ids.discard('')
+    return sorted(ids)
+
+
+def corresponding_status(record, institution_id):
+    '''
+    Input: cached record for a DOI, OpenAlex institution ID
+    Returns: 'yes' / 'no' / 'unknown', same values as the is_corresponding column
+    '''
+    if not record:      # not in OpenAlex, or no corresponding author flagged
+        return 'unknown'
+    return 'yes' if institution_id in record else 'no'
+
+
+class OpenAlexClient:
+    '''Batched DOI lookups against the OpenAlex works endpoint, run from asyncio with bounded concurrency'''
+
+    def __init__(self, base_url=OPENALEX_WORKS_URL, mailto=None, concurrency=4, requests_per_second=8,
+                 retries=4, backoff=1.0, timeout=30):
+        self.base_url = base_url
+        self.mailto = mailto            # puts us in OpenAlex's polite pool
+        self.concurrency = concurrency
+        self.requests_per_second = requests_per_second
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _session(self):
+        # requests sessions aren't thread safe, keep one per worker thread
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _get(self, params):
+        return self._session().get(self.base_url, params=params, timeout=self.timeout)
+
+    async def fetch_batch(self, dois, semaphore, limiter):
+        '''
+        Input: up to BATCH_SIZE normalized DOIs
+        Returns: dict of DOI -> corresponding institution IDs, None for DOIs OpenAlex doesn't have
+        '''
+        params = {'filter': 'doi:' + '|'.join(dois), 'per-page': len(dois), 'select': 'doi,authorships'}
+        if self.mailto:
+            params['mailto'] = self.mailto
+
+        for attempt in range(self.retries + 1):
+            async with semaphore:
+                await limiter.wait()
+                try:
+                    response = await asyncio.to_thread(self._get, params)
+                except requests.RequestException:
+                    if attempt == self.retries:
+                        raise
+                    response = None
+
+            if response is not None and response.status_code == 200:
+                records = dict.fromkeys(dois)
+                for work in response.json().get('results', []):
+                    if work.get('doi'):
+                        records[normalize_doi(work['doi'])] = corresponding_institutions(work)
+                return records
+            if response is not None and response.status_code not in RETRY_STATUS:
+                response.raise_for_status()
+            if attempt == self.retries:
+                response.raise_for_status()
+
+            retry_after = response.headers.get('Retry-After') if response is not None else None
+            await asyncio.sleep(float(retry_after) if retry_after and retry_after.isdigit() else self.backoff * 2 ** attempt)
+
+    async def fetch(self, dois, cache, progress=None):
+        '''
+        Fetches every DOI not already in cache, storing each batch as soon as it arrives
+        Returns: dict of DOI -> record for all of dois
+        '''
+        records = cache.get_many(dois)
+        missing = [doi for doi in dict.fromkeys(dois) if doi not in records]
+        semaphore = asyncio.Semaphore(self.concurrency)
+        limiter = RateLimiter(self.requests_per_second)
+
+        tasks = [asyncio.create_task(self.fetch_batch(missing[start:start + BATCH_SIZE], semaphore, limiter))
+                 for start in range(0, len(missing), BATCH_SIZE)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                batch = await task
+                cache.put_many(batch)
+                records.update(batch)
+                if progress is not None:
+                    progress.update(len(batch))
+        finally:
+            for task in tasks:
+                task.cancel()
+        return records
+
+
+def enrich_corresponding(merged, institution_id, cache_path=CACHE_FILE, client=None, show_progress=True):
+    '''
+    Input: merged dataframe with a DOI column, OpenAlex institution ID
+    Returns: copy with is_corresponding filled from OpenAlex, in the compact schema (see schema.py)
+    '''
+    client = client or OpenAlexClient()
+    dois = merged['DOI'].dropna().map(normalize_doi)
+    cache = ResponseCache(cache_path)
+    try:
+        with tqdm(total=dois.nunique(), desc='OpenAlex', disable=not show_progress) as progress:
+            records = asyncio.run(client.fetch(dois.unique().tolist(), cache, progress))
+    finally:
+        cache.close()
+
+    merged = merged.copy()
+    status = {doi: corresponding_status(record, institution_id) for doi, record in records.items()}
+    merged['is_corresponding'] = dois.map(status).reindex(merged.index).fillna('unknown')
+    return to_compact(merged)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fill is_corresponding from OpenAlex for a merged file')
+    parser.add_argument('merged_file')
+    parser.add_argument('--institution-id', required=True, help='OpenAlex institution ID, e.g. I173911158')
+    parser.add_argument('--output', help='defaults to overwriting merged_file (same columns and yes/no/unknown flags)')
+    parser.add_argument('--mailto', help='contact email for the OpenAlex polite pool')
+    parser.add_argument('--cache', default=CACHE_FILE)
+    parser.add_argument('--base-url', default=OPENALEX_WORKS_URL)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests-per-second', type=float, default=8)
+    args = parser.parse_args()
+
+    client = OpenAlexClient(base_url=args.base_url, mailto=args.mailto, concurrency=args.concurrency,
+                            requests_per_second=args.requests_per_second)
+    merged = enrich_corresponding(pd.read_parquet(args.merged_file), args.institution_id, cache_path=args.cache, client=client)
+    write_merged(merged, args.output or args.merged_file)
+    print(flag_labels(merged['is_corresponding']).value_counts().to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+# Export stage for the IOI Publishing Profiler
+# The CSV side outputs (yesyes, groupbys, funders exploded...) used to be written with to_csv on every rerun,
+# inside the page render. Now they go to a small thread pool, and get skipped when the content hasn't changed.
+# Other writes that don't belong in the render (e.g. the summary store) can go through the same pool with submit_task
+
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import pandas as pd
+
+from instrumentation import stage
+
+logger = logging.getLogger(__name__)
+
+# format -> (file extension, writer)
+EXPORT_FORMATS = {
+    'csv': ('.csv', lambda df, path: df.to_csv(path, index=False)),
+    'parquet': ('.parquet', lambda df, path: df.to_parquet(path, index=False, compression='zstd')),
+}
+
+MANIFEST_NAME = '.export_manifest.json'
+
+
+def write_atomic(path, write):
+    '''
+    Input: destination path, function writing the file to the path it's given (e.g. lambda tmp: df.to_csv(tmp))
+    Writes a uniquely named temporary file next to path and swaps it in with os.replace,
+    so whoever reads path (the app, other workers) sees the old file or the new one, never half of one
+    '''
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.', suffix='.tmp')
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def frame_hash(df: pd.DataFrame) -> str:
+    '''
+    Input: any dataframe, list columns (ParentAgency) included
+    Returns: sha1 hex digest of the column names and values, index ignored
+    '''
+    sha = hashlib.sha1(json.dumps([str(c) for c in df.columns]).encode())
+    for column in df.columns:
+        values = df[column]
+        try:
+            hashed = pd.util.hash_pandas_object(values, index=False)
+        except TypeError:
+            # lists aren't hashable, hash what to_csv would write instead
+            hashed = pd.util.hash_pandas_object(values.astype(str), index=False)
+        sha.update(hashed.to_numpy().tobytes())
+    return sha.hexdigest()
+
+
+class ExportStage:
+    '''
+    Writes dataframes in background threads
+
+    Every export directory keeps a small manifest of content hashes, a file is only
+    rewritten when the dataframe going into it is different from what's on disk
+    '''
+
+    def __init__(self, max_workers=2, fmt='csv'):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f'Unknown export format {fmt!r}, choose from {sorted(EXPORT_FORMATS)}')
+        self.fmt = fmt
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='export')
+        self._lock = threading.Lock()
+        self._manifests = {}
+        self._pending = set()
+        self._keys = {}
+
+    def submit(self, df, path_stem: str, fmt=None, key=None):
+        '''
+        Input: dataframe (or a function returning one, called in the worker only if key changed),
+               output path without extension, optional format overriding the default,
+               optional key describing the inputs df was built from (e.g. source file hash + chosen funder)
+        Returns: Future resolving to True if the file was written, False if it was already up to date,
+                 or None when key matches the last export to this path and nothing was submitted
+        Don't modify df after handing it over
+        '''
+        fmt = fmt or self.fmt
+        path = path_stem + EXPORT_FORMATS[fmt][0]
+        return self._submit(path, key, self._export, df, path, fmt)
+
+    def submit_task(self, name, func, *args, key=None):
+        '''
+        Input: task name, function to run in the pool and its arguments,
+               optional key like submit's, a task with the same name and key as last time isn't submitted again
+        Returns: Future resolving to func's return value, or None when nothing was submitted
+        '''
+        def run():
+            with stage(name):
+                return func(*args)
+        return self._submit(name, key, run)
+
+    def _submit(self, slot, key, func, *args):
+        with self._lock:
+            if key is not None and self._keys.get(slot) == key:
+                return None
+            self._keys[slot] = key
+
+        # the worker records its stage into whatever trace (instrumentation.py) the caller has open
+        future = self._pool.submit(contextvars.copy_context().run, func, *args)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def wait(self):
+        '''Block until everything submitted so far is on disk'''
+        with self._lock:
+            pending = list(self._pending)
+        wait(pending)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+        if future.exception() is not None:
+            with self._lock:
+                self._keys.clear()
+            logger.error('Export failed', exc_info=future.exception())
+
+    def _export(self, df, path, fmt):
+        directory, name = os.path.split(path)
+        with stage(f'export {name}') as record:
+            if callable(df):
+                df = df()
+            record.rows_in = len(df)
+            digest = frame_hash(df) + ':' + fmt
+            with self._lock:
+                manifest = self._manifest(directory)
+                if manifest.get(name) == digest and os.path.exists(path):
+                    record.rows_out = 0
+                    return False
+
+            write_atomic(path, lambda tmp_path: EXPORT_FORMATS[fmt][1](df, tmp_path))
+            record.rows_out = len(df)
+
+        with self._lock:
+            manifest[name] = digest
+            _write_manifest(directory, manifest)
+        return True
+
+    def _manifest(self, directory):
+        if directory not in self._manifests:
+            try:
+                with open(os.path.join(directory, MANIFEST_NAME)) as f:
+                    self._manifests[directory] = json.load(f)
+            except (OSError, ValueError):
+                self._manifests[directory] = {}
+        return self._manifests[directory]
+
+
+def _write_manifest(directory, manifest):
+    def write(tmp_path):
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+    write_atomic(os.path.join(directory, MANIFEST_NAME), write)
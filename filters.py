@@ -0,0 +1,125 @@
+# User-selectable filters for the IOI Publishing Profiler: a PubYear range, Open Access statuses, publishers
+# A ProfileFilter is a plain tuple, so it can be a cache key, and the same filter works at every level:
+#
+#   load_merged(path, profile_filter=f)     # pushed down into the parquet read (pipeline.py)
+#   f.apply(funders_exploded)               # DOI-level rows already in memory
+#   filtered_tables(cache, ..., f)          # profile_tables of the filtered cube, kept in the shared cache
+#
+# All three filter columns are cube dimensions, so filtering the cube gives the same counts as filtering the merged file
+
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from aggregates import profile_tables
+
+FILTER_COLUMNS = {'years': 'PubYear', 'open_access': 'Open Access', 'publishers': 'Publisher'}
+
+
+class ProfileFilter(NamedTuple):
+    '''None means no filter on that column'''
+    years: tuple = None             # (first, last) PubYear, both included
+    open_access: tuple = None       # Open Access values to keep
+    publishers: tuple = None        # Publishers to keep
+
+    @classmethod
+    def make(cls, years=None, open_access=None, publishers=None):
+        '''
+        Builds the filter from widget values, lists are sorted into tuples so the same selection is the same key
+        An empty selection means no filter, not no rows
+        '''
+        def values(selected):
+            return tuple(sorted(selected)) if selected else None
+        return cls(tuple(int(year) for year in years) if years else None, values(open_access), values(publishers))
+
+    @property
+    def active(self):
+        return any(value is not None for value in self)
+
+    def covers(self, other) -> bool:
+        '''True if every row other keeps is kept by this filter too, so other can be applied to this one's result'''
+        if self.years is not None:
+            if other.years is None or other.years[0] < self.years[0] or other.years[1] > self.years[1]:
+                return False
+        for field in ('open_access', 'publishers'):
+            mine, theirs = getattr(self, field), getattr(other, field)
+            if mine is not None and (theirs is None or not set(theirs) <= set(mine)):
+                return False
+        return True
+
+    def parquet_filters(self, schema: pa.Schema = None):
+        '''
+        Input: schema of the file about to be read (pyarrow.parquet.read_schema), if known
+        Returns: filters for pd.read_parquet, None when there's nothing to push down
+        Columns with a type the filter can't be compared to (e.g. PubYear stored as text) are left to apply()
+        '''
+        def pushable(column, check):
+            return schema is None or (column in schema.names and check(schema.field(column).type))
+
+        def text(kind):
+            return pa.types.is_string(kind) or pa.types.is_large_string(kind) or pa.types.is_dictionary(kind)
+
+        filters = []
+        if self.years is not None and pushable('PubYear', pa.types.is_integer):
+            filters += [('PubYear', '>=', self.years[0]), ('PubYear', '<=', self.years[1])]
+        if self.open_access is not None and pushable('Open Access', text):
+            filters.append(('Open Access', 'in', list(self.open_access)))
+        if self.publishers is not None and pushable('Publisher', text):
+            filters.append(('Publisher', 'in', list(self.publishers)))
+        return filters or None
+
+    def mask(self, frame: pd.DataFrame) -> np.ndarray:
+        '''Rows of a cube or DOI-level frame this filter keeps, columns the frame doesn't have are skipped'''
+        keep = np.ones(len(frame), dtype=bool)
+        for field, column in FILTER_COLUMNS.items():
+            value = getattr(self, field)
+            if value is None or column not in frame:
+                continue
+            if field == 'years':
+                year = pd.to_numeric(frame[column], errors='coerce')
+                keep &= year.between(*value).fillna(False).to_numpy(dtype=bool)
+            else:
+                keep &= frame[column].isin(value).to_numpy()
+        return keep
+
+    def apply(self, frame: pd.DataFrame) -> pd.DataFrame:
+        '''frame with only the rows this filter keeps, index left as it was'''
+        return frame[self.mask(frame)] if self.active else frame
+
+
+NO_FILTER = ProfileFilter()
+
+
+def filter_options(cube: pd.DataFrame) -> dict:
+    '''
+    What there is to filter on in one institution's cube, so nothing about the data is hard-coded
+    Returns: {'years': sorted PubYears, 'open_access': sorted statuses, 'publishers': biggest first}
+    '''
+    years = pd.to_numeric(cube['PubYear'], errors='coerce').dropna().astype(int)
+    publishers = cube.groupby('Publisher', observed=True)['DOI'].sum().sort_values(ascending=False, kind='stable')
+    return {'years': sorted(years.unique().tolist()),
+            'open_access': sorted(cube['Open Access'].dropna().astype(str).unique()),
+            'publishers': [str(p) for p in publishers.index[publishers.to_numpy() > 0]]}
+
+
+def filtered_tables(cache, link, source_hash, cube: pd.DataFrame, tables: dict, profile_filter=NO_FILTER) -> dict:
+    '''
+    Input: the SharedFrameCache, merged file and its hash, its full cube and profile_tables, the filter
+    Returns: profile_tables of the filtered cube
+    Each filtered (cube, tables) is its own ('view', link, source_hash, filter) entry, so it's sized and evicted
+    like everything else. A new filter starts from the smallest cached cube that covers it, so narrowing
+    the view filters an already narrowed cube instead of starting over from the full one
+    '''
+    if not profile_filter.active:
+        return tables
+
+    def build():
+        covering = [view[0] for key, view in cache.items(('view', link, source_hash)) if key[3].covers(profile_filter)]
+        filtered = profile_filter.apply(min(covering, key=len, default=cube))
+        return filtered, profile_tables(filtered)
+
+    # the group drops this filter's views of an older version of the file
+    view = cache.get_or_build(('view', link, source_hash, profile_filter), build, group=('view', link, profile_filter))
+    return view[1]
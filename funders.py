@@ -0,0 +1,374 @@
+# Funder name conversion
+# Match Dimensions `Funder` strings to the 2nd level Parent agencies (under US Govt.)
+
+import re
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+FUNDER_LOOKUP_FILE = 'Dimensions_USFFGroup_mapped_to_RORs_and_2ndlevel_parent_onlytwocolumns.csv'
+
+# words that can sit between known names in a Funder part without making it a different funder
+CONNECTOR_WORDS = {'the', 'and', 'us', 'u', 's', 'usa'}
+
+_PARENTHESES = re.compile(r'\([^)]*\)')
+_APOSTROPHES = re.compile(r"['\u2018\u2019]")
+_PUNCTUATION = re.compile(r'[\W_]+')
+
+
+def load_dict_from_csv(file_path, key_column, value_column):
+    """Loads a dictionary from an csv file.
+
+    Args:
+        file_path: The path to the file.
+        key_column: The name of the column to use as keys in the dictionary.
+        value_column: The name of the column to use as values in the dictionary.
+
+    Returns:
+        A dictionary created from the data.
+    """
+
+    dict_df = pd.read_csv(file_path)
+    lookup_data = dict(zip(dict_df[key_column], dict_df[value_column]))
+    return lookup_data
+
+
+def convert_Funder_string_to_Parent(funder_string: str, lookup_data: dict) -> list:
+    """
+    Pass in Dimensions `Funder` cell on each row
+    Comes in as long string of funder names
+    Want to isolate the US federal funders and use the conversion file to get the 2nd level Parent name
+
+
+    Input: Funder cell (Directorate for Computer & Information Science & Engineering; National Cancer Institute)
+    Output: List of Parent names (['US National Science Foundation', 'Health and Human Services'])
+    """
+    result = []
+
+    for part in funder_string.split('; '):  # when only one passed in, no semicolon, still returns it
+        parent = lookup_data.get(part)
+        if parent:
+            result.append(parent)
+
+    return(result)
+
+
+def dedupe_Funder_names(multiple_funder_string: list) -> list:
+    '''
+    Takes in a list of normalized 2nd level funder names
+    Converts to set to keep only unique ones
+    Converts back to list
+    Returns list of only the unique ones
+    '''
+    newset = set(multiple_funder_string)
+    return(list(newset))
+
+
+def load_funder_mapping(file_path=FUNDER_LOOKUP_FILE, key_column='Name_no_parentheses', value_column='parentName') -> pd.DataFrame:
+    '''
+    Input: the Dimensions USFF group to 2nd level Parent conversion file
+    Returns: two column dataframe (key_column, value_column), parent names as a categorical
+    Duplicate names keep the last row, same as building the dict with load_dict_from_csv
+    '''
+    mapping = pd.read_csv(file_path, usecols=[key_column, value_column])
+    mapping = mapping.drop_duplicates(subset=key_column, keep='last').reset_index(drop=True)
+    mapping[value_column] = mapping[value_column].astype('category')
+    return mapping.rename(columns={key_column: 'Name_no_parentheses', value_column: 'parentName'})
+
+
+def normalize_funder_name(name: str) -> str:
+    '''
+    Key used for matching funder names that aren't written exactly like the mapping
+    Drops parenthetical acronyms, casefolds, '&' becomes 'and', punctuation becomes spaces, whitespace collapsed
+    'National Science Foundation (NSF)' and 'national  science foundation' both give 'national science foundation'
+    '''
+    name = _PARENTHESES.sub(' ', name).casefold().replace('&', ' and ')
+    name = _APOSTROPHES.sub('', name)
+    return ' '.join(_PUNCTUATION.sub(' ', name).split())
+
+
+class FunderMatcher:
+    '''
+    Matching engine for Funder parts, built once from the mapping (load_funder_matcher)
+    Each part is tried as
+        1. the exact mapping name, same result as the dict lookup in convert_Funder_string_to_Parent
+        2. its normalized name (normalize_funder_name), so acronyms in parentheses, case and spacing don't matter
+        3. a walk through a word trie of the normalized names, a part that is nothing but known names
+           (plus CONNECTOR_WORDS) resolves to all of them, e.g. 'The National Cancer Institute, NSF (USA)'
+    A known name inside a longer one ('Swiss National Science Foundation') is a different funder, those parts
+    stay unmatched and get counted as 'partial' so they can be checked and added to the mapping file
+
+    stats counts Funder name mentions (parts weighted by rows) per outcome over every match() call,
+    partial counts the 'partial' parts themselves
+    fuzzy=False only does step 1
+    '''
+
+    def __init__(self, mapping: pd.DataFrame, fuzzy=True):
+        self.mapping = mapping
+        self.parents = mapping['parentName'].cat.categories
+        self.fuzzy = fuzzy
+        self.stats = Counter()
+        self.partial = Counter()
+        self.ambiguous = []         # normalized names shared by mapping rows with different Parents, left out
+        self._keys = pd.Index(mapping['Name_no_parentheses'])
+        self._codes = mapping['parentName'].cat.codes.to_numpy()
+        self._normalized = {}       # normalized name -> parentName code
+        self._trie = {}             # word -> {word -> ...}, None key holds the parentName code where a name ends
+        self._resolved = {}         # non-exact part -> resolve() result, the same parts keep coming back
+        if fuzzy:
+            self._build()
+
+    def _build(self):
+        ambiguous = set()
+        for name, code in zip(self._keys, self._codes):
+            key = normalize_funder_name(name)
+            if key and self._normalized.setdefault(key, code) != code:
+                ambiguous.add(key)
+        for key in ambiguous:
+            del self._normalized[key]
+        self.ambiguous = sorted(ambiguous)
+
+        for key, code in self._normalized.items():
+            node = self._trie
+            for word in key.split():
+                node = node.setdefault(word, {})
+            node[None] = code
+
+    def _longest_name(self, words: list, start: int) -> tuple:
+        '''(parentName code, end) of the longest known name starting at words[start], (None, start) if none does'''
+        node, found = self._trie, (None, start)
+        for end in range(start, len(words)):
+            node = node.get(words[end])
+            if node is None:
+                break
+            if None in node:
+                found = (node[None], end + 1)
+        return found
+
+    def resolve(self, part: str) -> tuple:
+        '''
+        Input: one Funder part that isn't an exact mapping name
+        Returns: (outcome, parentName codes), outcome is 'normalized', 'trie', 'partial' or 'unmatched'
+        '''
+        if part in self._resolved:
+            return self._resolved[part]
+        key = normalize_funder_name(part)
+        if key in self._normalized:
+            result = ('normalized', (self._normalized[key],))
+        else:
+            # leftmost-longest known names, anything between them other than connector words means it's not just them
+            words = key.split()
+            found, covered, i = [], True, 0
+            while i < len(words):
+                code, end = self._longest_name(words, i)
+                if code is None:
+                    covered = covered and words[i] in CONNECTOR_WORDS
+                    i += 1
+                else:
+                    found.append(code)
+                    i = end
+            if found and covered:
+                result = ('trie', tuple(found))
+            else:
+                result = ('partial' if found else 'unmatched', ())
+        self._resolved[part] = result
+        return result
+
+    def match(self, parts: list, weights=None) -> tuple:
+        '''
+        Resolves a whole list of Funder parts at once, exact names in one index lookup,
+        everything else once per unique part
+        Input: parts, optionally how many rows each part stands for (for stats)
+        Returns: (positions, parent codes) of every match in part order, a part can match more than one Parent
+        '''
+        weights = np.ones(len(parts), dtype=np.int64) if weights is None else np.asarray(weights)
+        keys = self._keys.get_indexer(parts)
+        exact = np.flatnonzero(keys >= 0)
+        missed = np.flatnonzero(keys < 0)
+        stats = Counter(exact=int(weights[exact].sum()))
+        positions, parents = [exact], [self._codes[keys[exact]]]
+
+        if not self.fuzzy:
+            stats['unmatched'] = int(weights[missed].sum())
+        elif len(missed):
+            ucodes, uniques = pd.factorize(np.asarray(parts, dtype=object)[missed])
+            resolved = [self.resolve(part) for part in uniques]
+            mentions = np.bincount(ucodes, weights=weights[missed], minlength=len(uniques)).astype(np.int64)
+            for part, (outcome, _), count in zip(uniques, resolved, mentions.tolist()):
+                stats[outcome] += count
+                if outcome == 'partial':
+                    self.partial[part] += count
+
+            # every missed part takes its unique part's run of codes
+            n_codes = np.array([len(codes) for _, codes in resolved], dtype=np.int64)
+            flat = np.array([code for _, codes in resolved for code in codes], dtype=self._codes.dtype)
+            counts = n_codes[ucodes]
+            within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            positions.append(np.repeat(missed, counts))
+            parents.append(flat[np.repeat((np.cumsum(n_codes) - n_codes)[ucodes], counts) + within])
+
+        self.stats.update(stats)
+        positions, parents = np.concatenate(positions), np.concatenate(parents)
+        order = np.argsort(positions, kind='stable')
+        return positions[order], parents[order]
+
+    def stats_frame(self) -> pd.DataFrame:
+        '''match outcomes so far, mentions and share of all mentions'''
+        outcomes = ['exact', 'normalized', 'trie', 'partial', 'unmatched']
+        frame = pd.DataFrame({'outcome': outcomes, 'mentions': [self.stats[o] for o in outcomes]})
+        frame['percent'] = (frame['mentions'] / max(frame['mentions'].sum(), 1) * 100).round(2)
+        return frame
+
+
+def load_funder_matcher(file_path=FUNDER_LOOKUP_FILE) -> FunderMatcher:
+    '''FunderMatcher over load_funder_mapping(file_path), build it once and reuse it'''
+    return FunderMatcher(load_funder_mapping(file_path))
+
+
+def _as_matcher(mapping) -> FunderMatcher:
+    '''a plain mapping dataframe matches exact names only, like it always has'''
+    return mapping if isinstance(mapping, FunderMatcher) else FunderMatcher(mapping, fuzzy=False)
+
+
+def _match_funder_parts(funder: pd.Series, matcher: FunderMatcher) -> tuple:
+    '''
+    Splits the whole Funder column on '; ' at once and matches every part in one FunderMatcher.match call
+    Only the unique Funder strings get split, the same long funder list shows up on lots of DOIs
+
+    Returns: (codes, n_uniques, pairs)
+        codes     position of each row's Funder string in the unique strings, -1 when there's no Funder
+        n_uniques number of unique Funder strings
+        pairs     one row per matched part/Parent, `uid` is the unique string, `parent` the parentName category code
+    '''
+    codes, uniques = pd.factorize(funder)
+    uniques = uniques.tolist()
+
+    # one big split instead of one per row, the part counts tell us which string each part came from
+    n_parts = np.fromiter((u.count('; ') + 1 for u in uniques), dtype=np.int64, count=len(uniques))
+    parts = '; '.join(uniques).split('; ') if uniques else []
+    uid = np.repeat(np.arange(len(uniques)), n_parts)
+
+    # rows per unique string, so the match stats count mentions rather than distinct strings
+    rows_per_unique = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    positions, parent_codes = matcher.match(parts, weights=rows_per_unique[uid])
+    return codes, len(uniques), pd.DataFrame({'uid': uid[positions], 'parent': parent_codes})
+
+
+def _collect_lists(codes: np.ndarray, n_uniques: int, pairs: pd.DataFrame, parents: pd.Index, index: pd.Index) -> pd.Series:
+    '''
+    Input: output of _match_funder_parts (pairs in uid order)
+    Returns: list of parent names per row, [] when nothing matched, NaN when there's no Funder
+    Rows with the same Funder string share one list object, don't modify them in place
+    '''
+    per_unique = [[] for _ in range(n_uniques)]
+    names = parents.to_numpy(dtype=object)[pairs['parent'].to_numpy()]
+    for u, name in zip(pairs['uid'].tolist(), names.tolist()):
+        per_unique[u].append(name)
+
+    values = np.full(len(codes), np.nan, dtype=object)
+    has_funder = codes >= 0
+    values[has_funder] = pd.Series(per_unique, dtype=object).to_numpy()[codes[has_funder]]
+    return pd.Series(values, index=index, name='ParentAgency')
+
+
+def _exploded_series(codes: np.ndarray, n_uniques: int, pairs: pd.DataFrame, parents: pd.Index, index: pd.Index) -> pd.Series:
+    '''
+    Input: output of _match_funder_parts (pairs in uid order)
+    Returns: categorical ParentAgency Series, one row per publication/Parent pair, index repeats
+    '''
+    uid = pairs['uid'].to_numpy()
+    per_unique = np.bincount(uid, minlength=n_uniques)
+    first = np.cumsum(per_unique) - per_unique
+
+    # every row takes its unique string's slice of pairs
+    rows = np.flatnonzero(codes >= 0)
+    counts = per_unique[codes[rows]]
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    take = np.repeat(first[codes[rows]], counts) + within
+    return pd.Series(pd.Categorical.from_codes(pairs['parent'].to_numpy()[take], categories=parents),
+                     index=index[np.repeat(rows, counts)], name='ParentAgency')
+
+
+def map_parent_agencies(funder: pd.Series, mapping) -> tuple:
+    '''
+    Batch version of convert_Funder_string_to_Parent + dedupe_Funder_names for a whole Funder column
+
+    Input: Funder column, FunderMatcher from load_funder_matcher (or a load_funder_mapping dataframe for exact names only)
+    Returns: (ParentAgency lists aligned on funder's index, unique names in first-seen order,
+              exploded ParentAgency categorical Series, one row per publication/Parent pair, index repeats)
+    '''
+    matcher = _as_matcher(mapping)
+    codes, n_uniques, pairs = _match_funder_parts(funder, matcher)
+    pairs = pairs.drop_duplicates()
+    parents = matcher.parents
+    return (_collect_lists(codes, n_uniques, pairs, parents, funder.index),
+            _exploded_series(codes, n_uniques, pairs, parents, funder.index))
+
+
+def explode_parent_agency(yesyes: pd.DataFrame, exploded: pd.Series) -> pd.DataFrame:
+    '''
+    Same rows as yesyes.explode('ParentAgency'), built from the exploded Series of map_parent_agencies
+    Publications without a matched Parent are kept once with a NaN ParentAgency
+    yesyes needs a unique index, exploded's index points into it
+    '''
+    position = pd.Series(np.arange(len(yesyes)), index=yesyes.index)
+    matched = position[exploded.index].to_numpy()
+    unmatched = np.setdiff1d(position.to_numpy(), matched)
+    order = np.argsort(np.r_[matched, unmatched], kind='stable')
+
+    rows = np.r_[matched, unmatched][order]
+    parent = pd.Categorical(np.r_[exploded.to_numpy(dtype=object), np.full(len(unmatched), np.nan, dtype=object)][order],
+                            categories=exploded.cat.categories)
+    return yesyes.drop(columns=['ParentAgency'], errors='ignore').iloc[rows].assign(ParentAgency=parent)
+
+
+def add_parent_agency(yesyes: pd.DataFrame, mapping) -> tuple:
+    '''
+    Input: DOI-level dataframe with a `Funder` column (normally the yes_yes records),
+           FunderMatcher from load_funder_matcher (or a load_funder_mapping dataframe for exact names only)
+    Returns: (copy with `ParentAgencyWithDuplicates` and `ParentAgency` list columns added,
+              exploded ParentAgency Series like map_parent_agencies)
+    '''
+    yesyes = yesyes.copy()
+    matcher = _as_matcher(mapping)
+    codes, n_uniques, pairs = _match_funder_parts(yesyes['Funder'], matcher)
+    parents = matcher.parents
+    yesyes['ParentAgencyWithDuplicates'] = _collect_lists(codes, n_uniques, pairs, parents, yesyes.index)
+
+    # then you have to dedupe the 2nd level Parents. If it acknowledges USDA twice and NASA three times, just keep one of each.
+    pairs = pairs.drop_duplicates()
+    yesyes['ParentAgency'] = _collect_lists(codes, n_uniques, pairs, parents, yesyes.index)
+    return yesyes, _exploded_series(codes, n_uniques, pairs, parents, yesyes.index)
+
+
+class FunderIndex:
+    '''
+    Row order of funders_exploded sorted by ParentAgency, with each agency's range in it
+    Picking a funder is then a take of its own rows instead of a scan of the whole table.
+    Only the positions are kept, the rows come from the funders_exploded that's already cached with the profile
+    '''
+
+    def __init__(self, funders_exploded: pd.DataFrame):
+        parent = funders_exploded['ParentAgency'].astype('category')
+        codes = parent.cat.codes.to_numpy()
+        order = np.argsort(codes, kind='stable')
+        order = order[codes[order] >= 0]        # rows without a Parent aren't anybody's
+
+        counts = np.bincount(codes[order], minlength=len(parent.cat.categories))
+        stops = np.cumsum(counts)
+        self._order = order
+        self._ranges = {name: (stop - count, stop) for name, count, stop in zip(parent.cat.categories, counts, stops) if count}
+
+    @property
+    def nbytes(self):
+        '''what the index itself holds, for shared_cache.size_of'''
+        return self._order.nbytes + 16 * len(self._ranges)
+
+    def rows(self, funders_exploded: pd.DataFrame, agency) -> pd.DataFrame:
+        '''
+        Input: the funders_exploded this index was built from, ParentAgency
+        Returns: DOI-level rows for that agency, in their original order
+        '''
+        start, stop = self._ranges.get(agency, (0, 0))
+        return funders_exploded.iloc[self._order[start:stop]]
@@ -0,0 +1,160 @@
+# Incremental merge of Dimensions exports with the USFF DOI list
+# This is the old commented-out .merge block from the app, but it only merges the export slices it hasn't seen
+# (e.g. a new PubYear) and appends them to a parquet dataset partitioned by institution/PubYear,
+# instead of rebuilding the whole merged file every time
+#
+#   python incremental_merge.py --institution IowaStateUniversity --usff data/usff_dois.csv exports/ISU_2024.csv
+#   python incremental_merge.py --institution IowaStateUniversity --usff data/usff_dois.csv exports/*.csv --materialize
+
+import argparse
+import json
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from aggregates import file_hash
+from enrich import normalize_doi
+from institutions import DATA_ROOT
+from schema import to_compact, write_compact
+
+MERGED_DATASET = os.path.join(DATA_ROOT, 'merged_dataset')
+MANIFEST_NAME = '_ingested.json'
+
+
+def read_export(path, header=1):
+    '''Dimensions export (csv/xlsx/parquet), header=1 skips the line Dimensions puts above the column names'''
+    if path.endswith('.xlsx'):
+        return pd.read_excel(path, header=header)
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_csv(path, header=header)
+
+
+def load_usff_dois(path, header=0):
+    '''
+    Input: file of US federally funded DOIs, with a DOI column
+    Returns: normalized, unique DOI Index, so membership checks are hash lookups
+    '''
+    usff = read_export(path, header=header)
+    return pd.Index(usff['DOI'].dropna().map(normalize_doi).unique())
+
+
+def merge_slice(df, usff_dois):
+    '''
+    Input: one Dimensions export slice, Index from load_usff_dois
+    Returns: merged records with is_USFF, in the compact schema (schema.combine_flags rebuilds the 'yes_yes' columns)
+    Same flags as left-joining on DOI against the USFF list, without duplicating rows when a DOI is listed twice
+    '''
+    merged = df[df['DOI'].notna()].copy()
+    merged['is_USFF'] = merged['DOI'].map(normalize_doi).isin(usff_dois)
+    if 'is_corresponding' not in merged:
+        merged['is_corresponding'] = 'unknown'      # fill it in later with enrich.py
+    return to_compact(merged)
+
+
+def append_slice(merged, institution, dataset_dir=MERGED_DATASET):
+    '''
+    Writes merged records into dataset_dir/institution=<institution>/PubYear=<year>/
+    Years present in the slice replace what was there before, other years aren't touched,
+    so slices should hold whole years
+    '''
+    merged = merged.assign(institution=institution)
+    # all-empty columns would come out as arrow's null type and clash with the same column in other slices
+    for column in merged.columns[merged.isna().all()]:
+        merged[column] = merged[column].astype('string')
+    ds.write_dataset(pa.Table.from_pandas(merged, preserve_index=False), dataset_dir, format='parquet',
+                     partitioning=['institution', 'PubYear'], partitioning_flavor='hive',
+                     existing_data_behavior='delete_matching',
+                     file_options=ds.ParquetFileFormat().make_write_options(compression='zstd'))
+
+
+def read_merged(institution, dataset_dir=MERGED_DATASET, columns=None):
+    '''
+    Input: institution partition name, optional list of columns
+    Returns: that institution's merged records, every year
+    '''
+    dataset = ds.dataset(dataset_dir, format='parquet', partitioning='hive')
+    # older slices can have slightly different column types, widen them to something every file fits
+    schema = pa.unify_schemas([dataset.schema] + [fragment.physical_schema for fragment in dataset.get_fragments()],
+                              promote_options='permissive')
+    dataset = ds.dataset(dataset_dir, schema=schema, format='parquet', partitioning='hive')
+    table = dataset.to_table(columns=columns, filter=ds.field('institution') == institution)
+    return to_compact(table.to_pandas().drop(columns=['institution'], errors='ignore'))
+
+
+def _read_manifest(dataset_dir):
+    try:
+        with open(os.path.join(dataset_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(dataset_dir, manifest):
+    os.makedirs(dataset_dir, exist_ok=True)
+    with open(os.path.join(dataset_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+
+def ingest(export_paths, usff_path, institution, dataset_dir=MERGED_DATASET, header=1):
+    '''
+    Merges and appends every export slice that changed since it was last ingested
+    A new USFF list means every slice has to be merged again, including the ones ingested on earlier runs
+    (they all have to be on disk still, FileNotFoundError otherwise)
+    Returns: list of the slices that were merged
+    '''
+    manifest = _read_manifest(dataset_dir)
+    seen = manifest.setdefault(institution, {})
+    usff_hash = file_hash(usff_path)
+
+    paths = list(export_paths)
+    if any(key.split(':')[-1] != usff_hash for key in seen.values()):
+        given = {os.path.abspath(path) for path in paths}
+        earlier = [path for path in seen if path not in given]
+        missing = [path for path in earlier if not os.path.exists(path)]
+        if missing:
+            raise FileNotFoundError(f'The USFF list changed, so every slice of {institution} has to be merged again, '
+                                    f'but these are gone: {missing}')
+        # earlier slices first, so the ones given now still win for any year both have
+        paths = earlier + paths
+
+    usff_dois = None
+    ingested = []
+    for path in paths:
+        slice_key = f'{file_hash(path)}:{usff_hash}'
+        if seen.get(os.path.abspath(path)) == slice_key:
+            continue
+        if usff_dois is None:
+            usff_dois = load_usff_dois(usff_path)
+        append_slice(merge_slice(read_export(path, header=header), usff_dois), institution, dataset_dir)
+        seen[os.path.abspath(path)] = slice_key
+        _write_manifest(dataset_dir, manifest)
+        ingested.append(path)
+    return ingested
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge new Dimensions export slices with the USFF DOI list')
+    parser.add_argument('exports', nargs='+', help='Dimensions export files (csv, xlsx or parquet)')
+    parser.add_argument('--institution', required=True, help='name without spaces, e.g. IowaStateUniversity')
+    parser.add_argument('--usff', required=True, help='file with the US federally funded DOIs')
+    parser.add_argument('--dataset', default=MERGED_DATASET)
+    parser.add_argument('--header', type=int, default=1, help='header row of the export files')
+    parser.add_argument('--materialize', action='store_true',
+                        help='also write data/<institution>/<institution>_merged_small.parquet for the app')
+    args = parser.parse_args()
+
+    ingested = ingest(args.exports, args.usff, args.institution, args.dataset, header=args.header)
+    print(f'{len(ingested)} of {len(args.exports)} export slices merged')
+
+    if args.materialize:
+        output = os.path.join(DATA_ROOT, args.institution, f'{args.institution}_merged_small.parquet')
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        write_compact(read_merged(args.institution, args.dataset), output)
+        print(f'Wrote {output}')
+
+
+if __name__ == '__main__':
+    main()
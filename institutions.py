@@ -0,0 +1,23 @@
+# Institutions the profiler knows about
+# make sure these names are what appears in the Dimensions export file for CA
+# For example, is it MIT or Massachusetts Institute of Technology?
+
+import os
+
+# OpenAlex IDs, lookup with https://api.openalex.org/institutions?search=name
+INSTITUTION_IDS = {'Iowa State University': 'I173911158',
+                   'Yale': 'I32971472',
+                   'MIT': 'I63966007',
+                   'test': 'I173911158'}
+
+DATA_ROOT = 'data'
+
+
+def nospaces(institution_name):
+    '''need a version of the name that can go into a filename'''
+    return institution_name.replace(' ', '')
+
+
+def data_dir(institution_name):
+    '''data/IowaStateUniversity for 'Iowa State University' '''
+    return os.path.join(DATA_ROOT, nospaces(institution_name))
@@ -0,0 +1,211 @@
+# Stage-level instrumentation for the IOI Publishing Profiler
+# Wrap a pipeline stage in `with stage('name'):` (or decorate it with @timed_stage()) and, while a Trace is open,
+# its wall time, rows in/out and peak memory get recorded. With no Trace open a stage costs next to nothing.
+#
+#   with Trace('IowaStateUniversity', memory=True) as trace:
+#       merged = load_merged(path)
+#       ...
+#   trace.write()       # data/traces/IowaStateUniversity_<timestamp>.json
+#   trace.to_frame()    # one row per stage
+#
+# Memory comes from tracemalloc (only switched on while a trace with memory=True is open, it slows allocations down).
+# Its peak is process-wide, so stages running at the same time in other threads show up in each other's peaks
+
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+import tracemalloc
+import weakref
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+import pandas as pd
+
+TRACE_DIR = os.path.join('data', 'traces')
+
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+_open_stages = contextvars.ContextVar('open_stages', default=())
+
+# open memory traces, tracemalloc is stopped when the last one finishes (if a trace started it)
+_memory_traces = 0
+_memory_lock = threading.Lock()
+_started_tracemalloc = False
+
+
+def _hold_tracemalloc():
+    global _memory_traces, _started_tracemalloc
+    with _memory_lock:
+        if _memory_traces == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started_tracemalloc = True
+        _memory_traces += 1
+
+
+def _release_tracemalloc():
+    global _memory_traces, _started_tracemalloc
+    with _memory_lock:
+        _memory_traces -= 1
+        if _memory_traces == 0 and _started_tracemalloc:
+            tracemalloc.stop()
+            _started_tracemalloc = False
+
+
+def rows(value):
+    '''Row count of a dataframe/series/list (first element of a tuple), None for anything else'''
+    if isinstance(value, tuple) and value:
+        value = value[0]
+    if isinstance(value, (pd.DataFrame, pd.Series, list, dict)):
+        return len(value)
+    return None
+
+
+class StageRecord:
+    '''One stage run, set rows_out (or rows_in) on it inside the with block if the stage can't tell'''
+
+    def __init__(self, name, rows_in=None, depth=0):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.depth = depth          # how many stages this one is nested in
+        self.started = None         # seconds since the trace started
+        self.seconds = None
+        self.peak_mb = None         # peak traced memory above what was allocated when the stage started
+        self._peak_seen = 0         # peaks reported by nested stages (they reset tracemalloc's peak)
+
+    def as_dict(self):
+        return {'stage': self.name, 'depth': self.depth, 'started': self.started, 'seconds': self.seconds,
+                'rows_in': self.rows_in, 'rows_out': self.rows_out, 'peak_mb': self.peak_mb}
+
+
+class Trace:
+    '''
+    Every stage run while this trace is open (same thread, or work handed off with contextvars.copy_context)
+    Use as a context manager, or start()/finish() when the traced code isn't one block
+    A memory trace that never gets finished (e.g. its run was interrupted) lets go of tracemalloc when it's garbage collected
+    '''
+
+    def __init__(self, name, memory=False, metadata=None):
+        self.name = name
+        self.memory = memory
+        self.metadata = metadata or {}
+        self.records = []
+        self.started_at = None
+        self.seconds = None
+        self.finished = False
+        self._start = None
+        self._token = None
+        self._release = None
+
+    def start(self):
+        self.started_at = datetime.now()
+        self._start = time.perf_counter()
+        if self.memory:
+            _hold_tracemalloc()
+            self._release = weakref.finalize(self, _release_tracemalloc)
+        self._token = _current_trace.set(self)
+        return self
+
+    def finish(self):
+        if self.finished:
+            return self
+        self.seconds = time.perf_counter() - self._start
+        self.finished = True
+        if self._release is not None:
+            self._release()     # only ever runs once
+        try:
+            _current_trace.reset(self._token)
+        except ValueError:
+            # finished from another context than it was started in (e.g. a later Streamlit rerun), just unset it
+            _current_trace.set(None)
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.finish()
+
+    def to_frame(self):
+        '''one row per stage in the order they started, nested stages indented by depth'''
+        frame = pd.DataFrame([record.as_dict() for record in self.records],
+                             columns=['stage', 'depth', 'started', 'seconds', 'rows_in', 'rows_out', 'peak_mb'])
+        frame = frame.astype({'rows_in': 'Int64', 'rows_out': 'Int64', 'peak_mb': 'float64'})
+        return frame.sort_values('started', kind='stable', ignore_index=True)
+
+    def as_dict(self):
+        return {'name': self.name, 'started_at': self.started_at.isoformat() if self.started_at else None,
+                'seconds': self.seconds, 'memory': self.memory, 'metadata': self.metadata,
+                'stages': self.to_frame().astype(object).where(lambda f: f.notna(), None).to_dict('records')}
+
+    def write(self, directory=TRACE_DIR):
+        '''
+        Writes the trace as JSON for comparing runs offline
+        Returns: path of the file, <name>_<YYYYmmdd-HHMMSS-ffffff>.json
+        '''
+        os.makedirs(directory, exist_ok=True)
+        safe_name = re.sub(r'[^\w.-]+', '_', self.name)
+        path = os.path.join(directory, f'{safe_name}_{self.started_at:%Y%m%d-%H%M%S-%f}.json')
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(), f, indent=1, default=str)
+        return path
+
+
+def current_trace():
+    '''The Trace stages are being recorded into, or None'''
+    return _current_trace.get()
+
+
+@contextmanager
+def stage(name, rows_in=None):
+    '''
+    Times the with block as one stage of the current trace
+    Yields: the StageRecord, set .rows_out on it when the block has produced something
+    '''
+    trace = _current_trace.get()
+    record = StageRecord(name, rows_in)
+    if trace is None or trace.finished:
+        yield record
+        return
+
+    parents = _open_stages.get()
+    record.depth = len(parents)
+    memory = trace.memory and tracemalloc.is_tracing()
+    if memory:
+        if parents:
+            parents[-1]._peak_seen = max(parents[-1]._peak_seen, tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+    token = _open_stages.set(parents + (record,))
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record.seconds = time.perf_counter() - start
+        record.started = start - trace._start
+        _open_stages.reset(token)
+        if memory:
+            peak = max(tracemalloc.get_traced_memory()[1], record._peak_seen)
+            record.peak_mb = max(peak - baseline, 0) / 2**20
+            if parents:
+                parents[-1]._peak_seen = max(parents[-1]._peak_seen, peak)
+        trace.records.append(record)
+
+
+def timed_stage(name=None):
+    '''
+    Decorator version of stage(), rows in/out taken from the first argument and the return value
+    name defaults to the function's name
+    '''
+    def decorate(func):
+        @wraps(func)
+        def run(*args, **kwargs):
+            with stage(name or func.__name__, rows_in=rows(args[0]) if args else None) as record:
+                result = func(*args, **kwargs)
+                record.rows_out = rows(result)
+            return result
+        return run
+    return decorate
@@ -0,0 +1,49 @@
+# IOI Publishing Profiler - compare institutions
+# Everything on this page comes from the summary store (summary_store.py), a few hundred rows of yearly counts,
+# so no DOI-level file gets loaded. Institutions get into the store when batch.py runs them,
+# or when they're opened on the main page
+
+import os
+
+import streamlit as st
+
+import charts
+from aggregates import file_hash
+from summary_store import SUMMARY_FILE, read_summary, shares
+
+st.header('Compare Institutions')
+st.markdown('#### Corresponding Authored and US Federally Funded shares, side by side')
+
+
+# the file hash is in the key so a rewritten store gets picked up
+@st.cache_data(max_entries=4)
+def load_summary(path, source_hash):
+    return read_summary(path)
+
+
+if not os.path.exists(SUMMARY_FILE):
+    st.write('No institutions summarized yet. Run `python batch.py`, or open an institution on the main page first.')
+    st.stop()
+
+summary = load_summary(SUMMARY_FILE, file_hash(SUMMARY_FILE))
+institutions = sorted(summary['institution'].astype(str).unique())
+chosen = st.multiselect('Institutions to compare', institutions, default=institutions)
+if not chosen:
+    st.stop()
+summary = summary[summary['institution'].isin(chosen)]
+
+col1, col2 = st.columns(2)
+with col1:
+    st.plotly_chart(charts.share_by_year(shares(summary, 'is_corresponding'), 'Corresponding Authored, % of records'))
+with col2:
+    st.plotly_chart(charts.share_by_year(shares(summary, 'is_USFF'), 'US Federally Funded, % of records'))
+
+st.plotly_chart(charts.share_by_year(shares(summary, 'yes_yes'), 'Corresponding Authored AND US Federally Funded, % of records'))
+
+# all years together
+overall = {flag: shares(summary.assign(PubYear='all'), flag).set_index('institution') for flag in ['is_corresponding', 'is_USFF', 'yes_yes']}
+st.dataframe(overall['is_corresponding'][['total']].rename(columns={'total': 'records'}).assign(**{
+    'Corresponding Authored %': overall['is_corresponding']['percent'],
+    'USFF %': overall['is_USFF']['percent'],
+    'yes_yes %': overall['yes_yes']['percent'],
+}))
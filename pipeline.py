@@ -0,0 +1,221 @@
+# Headless pipeline for one institution: load the merged file, match funders, build the cube, write exports
+# The Streamlit app and batch.py both go through these, so they always produce the same files
+
+import glob
+import hashlib
+import os
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from aggregates import file_hash, build_cube, merge_cubes, by_publisher, by_journal_title, by_funder
+from exports import write_atomic
+from filters import NO_FILTER
+from funders import FUNDER_LOOKUP_FILE, load_funder_matcher, add_parent_agency, explode_parent_agency
+from instrumentation import stage, timed_stage
+from schema import CATEGORY_COLUMNS, CORE_COLUMNS, is_yes_yes, read_compact, to_compact, to_labels, with_detail
+
+# merged files with more rows than this are aggregated a batch of rows at a time, see stream_profile
+STREAMING_MIN_ROWS = 2_000_000
+STREAM_BATCH_ROWS = 250_000
+
+# bump when build_cube or the funder matching change what ends up in a cube, so older precomputed cubes get rebuilt
+CUBE_VERSION = 2
+
+
+def find_merged_file(data_dir):
+    '''
+    Input: institution data directory (data/IowaStateUniversity)
+    Returns: path of the *_merged_small.parquet file, or None
+    '''
+    df_file_picker = glob.glob(os.path.join(data_dir, '*_merged_small.parquet'))
+    return df_file_picker[0] if df_file_picker else None
+
+
+@timed_stage('load')
+def load_merged(link, columns=CORE_COLUMNS, profile_filter=NO_FILTER):
+    '''
+    Input: merged file, columns to load (the wide text ones are left out by default, see schema.read_detail),
+           filters.ProfileFilter to read only some years / Open Access statuses / publishers
+    Returns: merged dataframe in the compact schema, indexed 0..n-1 after filtering
+    '''
+    if(link.endswith('.xlsx')):
+        merged = pd.read_excel(link, header=1)      # header=1 if Excel file
+        merged = to_compact(merged[[c for c in columns if c in merged]])
+    else:
+        # parquet does the filtering while reading, apply() then only catches what couldn't be pushed down
+        merged = read_compact(link, columns, filters=profile_filter.parquet_filters(pq.read_schema(link)))
+    return profile_filter.apply(merged).reset_index(drop=True)
+
+
+def cube_key(source_hash, mapping_file=FUNDER_LOOKUP_FILE):
+    '''
+    Input: hash of the merged file, funder lookup file the ParentAgency column comes from
+    Returns: hash of both files and CUBE_VERSION, a precomputed cube is only good for that combination
+    '''
+    return hashlib.sha1(f'{source_hash}:{file_hash(mapping_file)}:{CUBE_VERSION}'.encode()).hexdigest()
+
+
+def cube_path(data_dir, source_hash):
+    '''Precomputed cube for one version of the merged file, data/IowaStateUniversity/IowaStateUniversity_cube_<cube_key>.parquet'''
+    name = os.path.basename(os.path.normpath(data_dir))
+    return os.path.join(data_dir, f'{name}_cube_{cube_key(source_hash)[:12]}.parquet')
+
+
+def save_cube(cube, data_dir, source_hash):
+    '''Writes the precomputed cube for this version of the merged file and funder lookup, older cubes are no use any more'''
+    path = cube_path(data_dir, source_hash)
+    # the app and other workers may be reading cubes from here
+    write_atomic(path, lambda tmp_path: cube.to_parquet(tmp_path, index=False, compression='zstd'))
+    name = os.path.basename(os.path.normpath(data_dir))
+    for stale in glob.glob(os.path.join(data_dir, f'{name}_cube_*.parquet')):
+        if os.path.normpath(stale) != os.path.normpath(path):
+            try:
+                os.remove(stale)
+            except FileNotFoundError:     # another worker got there first
+                pass
+
+
+def build_profile(merged, mapping=None, cube=None):
+    '''
+    Input: DOI-level merged dataframe, funder matcher (defaults to load_funder_matcher()),
+           and a precomputed cube for this merged file if there is one
+    Returns: (yesyes with ParentAgency lists, funders_exploded, cube)
+    '''
+    if mapping is None:
+        mapping = load_funder_matcher(FUNDER_LOOKUP_FILE)
+
+    # Match Funder strings to the names of the 2nd level Parents (under US Govt.), only needed for the yes_yes records
+    with stage('yes_yes filter', rows_in=len(merged)) as record:
+        yesyes = merged[is_yes_yes(merged)]
+        record.rows_out = len(yesyes)
+    with stage('funder mapping', rows_in=len(yesyes)) as record:
+        yesyes, parent_agency = add_parent_agency(yesyes, mapping)
+        record.rows_out = len(parent_agency)
+    with stage('explode', rows_in=len(yesyes)) as record:
+        funders_exploded = explode_parent_agency(yesyes, parent_agency)
+        record.rows_out = len(funders_exploded)
+
+    # one small count cube per institution, all the charts are built from it
+    if cube is None:
+        with stage('cube', rows_in=len(merged)) as record:
+            cube = build_cube(merged, parent_agency)
+            record.rows_out = len(cube)
+    return yesyes, funders_exploded, cube
+
+
+def should_stream(link, min_rows=STREAMING_MIN_ROWS):
+    '''True for parquet merged files too big to comfortably load in one go'''
+    return link.endswith('.parquet') and pq.ParquetFile(link).metadata.num_rows > min_rows
+
+
+def stream_profile(link, mapping=None, cube=None, batch_size=STREAM_BATCH_ROWS, profile_filter=NO_FILTER, keep_rows=True):
+    '''
+    Same as build_profile(load_merged(link, profile_filter=profile_filter), mapping, cube), index included,
+    without ever holding the whole file
+    Reads batch_size rows at a time, keeps their yes_yes records and adds their counts to a running cube,
+    so memory is one batch + the yes_yes records + about twice the cube.
+    keep_rows=False is for callers that only want the cube (report.py, warm_start.py), the yes_yes records
+    aren't kept and memory stays at one batch + the cube whatever the size of the file
+    Returns: (yesyes with ParentAgency lists, funders_exploded, cube), the first two None with keep_rows=False
+    '''
+    if not keep_rows and cube is not None:
+        return None, None, profile_filter.apply(cube)
+    if mapping is None:
+        mapping = load_funder_matcher(FUNDER_LOOKUP_FILE)
+
+    parquet = pq.ParquetFile(link, read_dictionary=[c for c in CATEGORY_COLUMNS if c in pq.read_schema(link).names])
+    columns = [c for c in CORE_COLUMNS if c in parquet.schema_arrow.names]
+    build_cubes = cube is None
+    if not build_cubes:
+        cube = profile_filter.apply(cube)
+    yesyes_parts, parent_parts = [], []
+    partials, partial_rows = [], 0
+    offset = batches = 0
+    with stage('streaming aggregation', rows_in=parquet.metadata.num_rows) as record:
+        for batch in parquet.iter_batches(batch_size=batch_size, columns=columns):
+            chunk = profile_filter.apply(to_compact(batch.to_pandas()))
+            # row numbers of the kept rows carry on from the previous batch, same index load_merged would give
+            chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+            offset += len(chunk)
+            batches += 1
+
+            yesyes, parent_agency = add_parent_agency(chunk[is_yes_yes(chunk)], mapping)
+            if keep_rows:
+                yesyes_parts.append(yesyes)
+                parent_parts.append(parent_agency)
+            if build_cubes:
+                partial = build_cube(chunk, parent_agency)
+                partials.append(partial)
+                partial_rows += len(partial)
+                # fold the batch cubes in once they add up to the running cube's size, not after every batch
+                if partial_rows >= (0 if cube is None else len(cube)):
+                    cube = merge_cubes(([] if cube is None else [cube]) + partials)
+                    partials, partial_rows = [], 0
+        if partials:
+            cube = merge_cubes([cube] + partials)
+        record.rows_out = 0 if cube is None else len(cube)
+
+    if not batches:
+        # no row groups at all, fall back to the in-memory path for the empty frame
+        yesyes, funders_exploded, cube = build_profile(load_merged(link, profile_filter=profile_filter), mapping, cube)
+        return (yesyes, funders_exploded, cube) if keep_rows else (None, None, cube)
+    if not keep_rows:
+        return None, None, cube
+    # categories differ from batch to batch, concat gives plain objects, put them back
+    yesyes = to_compact(pd.concat(yesyes_parts))
+    parent_agency = pd.concat(parent_parts)
+    return yesyes, explode_parent_agency(yesyes, parent_agency), cube
+
+
+def profile_merged_file(merged_file, mapping=None, source_hash=None, profile_filter=NO_FILTER, keep_rows=True, save=False):
+    '''
+    The one way the app, batch.py, report.py and warm_start.py turn a merged file into a profile
+    Input: merged file, funder matcher (defaults to load_funder_matcher()), its file_hash if already known,
+           filters.ProfileFilter, keep_rows=False when only the cube is wanted,
+           save=True to write the cube next to the merged file (save_cube) when there isn't one for it yet
+    Returns: (yesyes, funders_exploded, cube) like build_profile, the first two None with keep_rows=False
+    The cube batch.py/warm_start.py precomputed for this file is used if it's there, really big files are streamed
+    '''
+    if save and profile_filter.active:
+        raise ValueError('Only the unfiltered cube can be saved as the precomputed one')
+    data_dir = os.path.dirname(merged_file)
+    source_hash = source_hash or file_hash(merged_file)
+    precomputed = cube_path(data_dir, source_hash)
+    cube = pd.read_parquet(precomputed) if os.path.exists(precomputed) else None
+    if save and cube is not None:
+        save = False
+
+    if should_stream(merged_file):
+        yesyes, funders_exploded, cube = stream_profile(merged_file, mapping, cube, profile_filter=profile_filter, keep_rows=keep_rows)
+    elif not keep_rows and cube is not None:
+        yesyes, funders_exploded, cube = None, None, profile_filter.apply(cube)
+    else:
+        yesyes, funders_exploded, cube = build_profile(load_merged(merged_file, profile_filter=profile_filter), mapping,
+                                                       None if cube is None else profile_filter.apply(cube))
+        if not keep_rows:
+            yesyes = funders_exploded = None
+
+    if save:
+        save_cube(cube, data_dir, source_hash)
+    return yesyes, funders_exploded, cube
+
+
+def export_profile(exporter, export_prefix, yesyes, funders_exploded, cube, key=None, merged_file=None):
+    '''
+    Hands the standard side outputs to an exports.ExportStage
+    export_prefix is data/<name>/<name>, key is passed on to ExportStage.submit (normally the source file hash)
+    With merged_file, the DOI-level outputs get their wide text columns back, read in the export worker
+    They're written with 'yes'/'no'/'unknown' flags, the combined flag columns and the merged file's column order, like always
+    '''
+    def doi_level(df):
+        if merged_file is None:
+            return to_labels(df)
+        return lambda: to_labels(with_detail(df, merged_file), pq.read_schema(merged_file).names)
+
+    exporter.submit(doi_level(yesyes.drop(columns=['ParentAgencyWithDuplicates', 'ParentAgency'])), f'{export_prefix}_yesyes', key=key)
+    exporter.submit(by_publisher(cube), f'{export_prefix}_yesyes_groupbypublisher', key=key)
+    exporter.submit(by_journal_title(cube), f'{export_prefix}_yesyes_groupbyjournaltitle', key=key)
+    exporter.submit(doi_level(yesyes), f'{export_prefix}_yesyes_with_funderDuplicates', key=key)
+    exporter.submit(doi_level(funders_exploded), f'{export_prefix}_DOIlevel_funders_exploded', key=key)
+    exporter.submit(by_funder(cube), f'{export_prefix}_yesyes_groupbyfunderexploded', key=key)
@@ -0,0 +1,218 @@
+# IOI Publishing Profiler - static report bundle
+# Renders the dashboard's figures (fig - fig14) and the publisher_50percent_point / journal_totals tables
+# for one or many institutions to plain HTML + Parquet files, so results can be shared without running Streamlit
+#
+#   python report.py                                  every institution in institutions.py, to data/report
+#   python report.py --institution Yale I32971472 data/Yale --output reports/yale
+#   python report.py --config institutions.csv --workers 8 --years 2018 2023
+#
+# data/report/index.html links one page per institution, data/report/<name>/ holds its page and tables.
+# Figures are built in a process pool. Each one is stored in data/report_cache under a hash of what goes into it
+# (its table, its options, charts.py and the Plotly version), so a nightly run only rebuilds figures whose data changed
+
+import argparse
+import hashlib
+import html
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+import plotly
+from tqdm import tqdm
+
+import charts
+from aggregates import file_hash, profile_tables
+from batch import read_institutions
+from exports import frame_hash, write_atomic
+from filters import NO_FILTER, ProfileFilter
+from institutions import DATA_ROOT, nospaces
+from pipeline import find_merged_file, profile_merged_file
+
+REPORT_DIR = os.path.join(DATA_ROOT, 'report')
+FIGURE_CACHE_DIR = os.path.join(DATA_ROOT, 'report_cache')
+
+# anything that changes how a figure looks for the same table
+CHARTS_VERSION = f'{file_hash(charts.__file__)}-{plotly.__version__}'
+
+
+def load_cube(institution_dir, profile_filter=NO_FILTER):
+    '''
+    Input: institution data directory, filters.ProfileFilter
+    Returns: the (filtered) cube for its merged file, None if there's no merged file
+    The one batch.py precomputed is used if it's there, otherwise the filter is pushed down into reading the merged file
+    '''
+    merged_file = find_merged_file(institution_dir)
+    if merged_file is None:
+        return None
+    return profile_merged_file(merged_file, profile_filter=profile_filter, keep_rows=False)[2]
+
+
+def load_tables(institution_dir, profile_filter=NO_FILTER):
+    '''profile_tables of the institution's (filtered) cube, None if there's no merged file, runs in a worker'''
+    cube = load_cube(institution_dir, profile_filter)
+    return None if cube is None else profile_tables(cube)
+
+
+def figure_specs(tables, institution_name, maxallowed=20, funders=None) -> list:
+    '''
+    The dashboard's figures for one institution, same tables, options and titles as the app
+    Input: profile_tables output, how many journal titles to show, funders to do fig12/fig14 for (defaults to all of them)
+    Returns: list of (figure id, heading, charts function name, table, keyword arguments)
+    '''
+    specs = [
+        ('fig', 'Corresponding Authored Records, Raw Counts', 'flag_by_year', tables['is_corresponding_by_year'], {'flag': 'is_corresponding'}),
+        ('fig2', 'Corresponding Authored Records, Percentages', 'flag_by_year', tables['is_corresponding_by_year'], {'flag': 'is_corresponding', 'percent': True}),
+        ('fig3', 'US Federally Funded, Raw Counts', 'flag_by_year', tables['is_USFF_by_year'], {'flag': 'is_USFF'}),
+        ('fig4', 'US Federally Funded, Percentages', 'flag_by_year', tables['is_USFF_by_year'], {'flag': 'is_USFF', 'percent': True}),
+        ('fig5', 'Corresponding Authored and US Federally Funded, Raw Counts', 'flag_by_year',
+         tables['is_corresponding_is_USFF_by_year'], {'flag': 'is_corresponding_is_USFF'}),
+        ('fig6', 'Corresponding Authored and US Federally Funded, Percentages', 'flag_by_year',
+         tables['is_corresponding_is_USFF_by_year'], {'flag': 'is_corresponding_is_USFF', 'percent': True}),
+        ('fig8', 'yes_yes by Publisher, By Count', 'publisher_by_year', tables['yesyes_bypublisher'], {}),
+        ('fig9', 'yes_yes by Publisher, By Percent', 'publisher_by_year', tables['yesyes_bypublisher'], {'percent': True}),
+        ('fig10', 'yes_yes by Journal Title', 'journals', tables['yesyes_byjournaltitle'],
+         {'color': 'PubYear', 'maxallowed': maxallowed, 'title': 'Top Journal Titles with Corresponding Authored USFF Outputs'}),
+        ('fig13', 'yes_yes by Journal Title and Open Access status', 'journals', tables['yesyes_byjournal_and_OA'],
+         {'color': 'Open Access', 'maxallowed': maxallowed, 'text': False,
+          'title': 'Top Journal Titles with Corresponding Authored USFF Outputs and Open Access status<br>Zoom or pan to see more'}),
+        ('fig11', 'yes_yes by Funder', 'funders', tables['yesyes_byfunderexploded'],
+         {'title': 'Top Funding Agencies with Corresponding Authored USFF Outputs<br>Papers that acknowledge more than one funder are included here multiple times'}),
+    ]
+
+    by_journal, by_OA = tables['chosenfunder_byjournaltitle'], tables['chosenfunder_byjournal_and_OA']
+    if funders is None:
+        funders = charts.totals(tables['yesyes_byfunderexploded'], 'ParentAgency')['ParentAgency'].tolist()
+    for number, funder in enumerate(f for f in funders if f in by_journal):
+        specs.append((f'fig12_{number}', f'{funder}, by Year', 'journals', by_journal[funder],
+                      {'color': 'PubYear', 'maxallowed': maxallowed,
+                       'title': f'Top Journal Titles with Corresponding Author from {institution_name}<br>and Funding from {funder}, by Year'}))
+        specs.append((f'fig14_{number}', f'{funder}, by Open Access status', 'journals', by_OA[funder],
+                      {'color': 'Open Access', 'maxallowed': maxallowed, 'text': False,
+                       'title': f'Top Journal Titles with Corresponding Author from {institution_name}<br>and Funding from {funder}, by Open Access status'}))
+    return specs
+
+
+def figure_key(figure_id, function, table, kwargs) -> str:
+    '''Content address of one rendered figure, the same inputs always give the same key'''
+    parts = [CHARTS_VERSION, figure_id, function, frame_hash(table), json.dumps(kwargs, sort_keys=True, default=str)]
+    return hashlib.sha1('\n'.join(parts).encode()).hexdigest()
+
+
+def render_figure(figure_id, function, table, kwargs) -> str:
+    '''Builds one figure and returns it as an HTML fragment (plotly.js is loaded once per page), runs in a worker'''
+    fig = getattr(charts, function)(table, **kwargs)
+    return fig.to_html(full_html=False, include_plotlyjs=False, div_id=figure_id)
+
+
+def table_html(table: pd.DataFrame, heading: str) -> str:
+    return f'<h3>{html.escape(heading)}</h3>\n{table.to_html(index=False, border=0)}'
+
+
+def write_page(path, title, body, plotly_src):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{html.escape(title)}</title>\n'
+                f'<script src="{plotly_src}"></script></head>\n<body>\n<h1>{html.escape(title)}</h1>\n{body}\n</body></html>\n')
+
+
+def write_institution(output, institution_name, tables, fragments, specs, maxallowed, profile_filter):
+    '''institution's page plus its two tables as Parquet, returns the page's path relative to output'''
+    directory = os.path.join(output, nospaces(institution_name))
+    os.makedirs(directory, exist_ok=True)
+
+    publisher_50percent_point = tables['publisher_50percent_point']
+    journal_totals = charts.totals(tables['yesyes_byjournaltitle'], 'Source title')
+    publisher_50percent_point.to_parquet(os.path.join(directory, 'publisher_50percent_point.parquet'), index=False)
+    journal_totals.to_parquet(os.path.join(directory, 'journal_totals.parquet'), index=False)
+
+    body = [f'<p>Filter: {html.escape(str(profile_filter))}</p>'] if profile_filter.active else []
+    for figure_id, heading, *_ in specs:
+        body.append(f'<h3>{html.escape(heading)}</h3>\n{fragments[figure_id]}')
+        if figure_id == 'fig9':
+            body.append(table_html(publisher_50percent_point, 'Publishers making up 50% of each year'))
+        elif figure_id == 'fig10':
+            body.append(table_html(journal_totals[:maxallowed], f'Top {maxallowed} Journal Titles'))
+    write_page(os.path.join(directory, 'index.html'), f'IOI Publishing Profiler: {institution_name}', '\n'.join(body), '../plotly.min.js')
+    return os.path.join(nospaces(institution_name), 'index.html')
+
+
+def _write_text(path, text):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def run_report(institutions, output=REPORT_DIR, workers=None, maxallowed=20, profile_filter=NO_FILTER, cache_dir=FIGURE_CACHE_DIR):
+    '''
+    Input: list of (institution name, OpenAlex ID, data directory), like batch.run_batch
+    Writes the bundle to output
+    Returns: (pages written, figures built, figures reused from the cache)
+    '''
+    os.makedirs(output, exist_ok=True)
+    os.makedirs(cache_dir, exist_ok=True)
+    pages, built, reused = [], 0, 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # tables first, one institution per worker
+        table_futures = {pool.submit(load_tables, institution_dir, profile_filter): name for name, _, institution_dir in institutions}
+        profiles = {}
+        for future in tqdm(as_completed(table_futures), total=len(table_futures), desc='Institutions'):
+            name = table_futures[future]
+            tables = future.result()
+            if tables is None:
+                tqdm.write(f'No merged file found for {name}, skipped')
+            else:
+                profiles[name] = (tables, figure_specs(tables, name, maxallowed))
+
+        # then every figure that isn't in the cache, from every institution at once
+        fragments = {name: {} for name in profiles}
+        figure_futures = {}
+        for name, (_, specs) in profiles.items():
+            for figure_id, _, function, table, kwargs in specs:
+                path = os.path.join(cache_dir, f'{figure_key(figure_id, function, table, kwargs)}.html')
+                if os.path.exists(path):
+                    with open(path, encoding='utf-8') as f:
+                        fragments[name][figure_id] = f.read()
+                    reused += 1
+                else:
+                    figure_futures[pool.submit(render_figure, figure_id, function, table, kwargs)] = (name, figure_id, path)
+        for future in tqdm(as_completed(figure_futures), total=len(figure_futures), desc='Figures'):
+            name, figure_id, path = figure_futures[future]
+            fragments[name][figure_id] = future.result()
+            # a cache entry is either complete or not there
+            write_atomic(path, lambda tmp_path: _write_text(tmp_path, fragments[name][figure_id]))
+            built += 1
+
+    with open(os.path.join(output, 'plotly.min.js'), 'w', encoding='utf-8') as f:
+        f.write(plotly.offline.get_plotlyjs())
+    for name in sorted(profiles):
+        tables, specs = profiles[name]
+        pages.append((name, write_institution(output, name, tables, fragments[name], specs, maxallowed, profile_filter)))
+    links = '\n'.join(f'<li><a href="{html.escape(page)}">{html.escape(name)}</a></li>' for name, page in pages)
+    write_page(os.path.join(output, 'index.html'), 'IOI Publishing Profiler', f'<ul>\n{links}\n</ul>', 'plotly.min.js')
+    return pages, built, reused
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write the IOI Publishing Profiler figures and tables to a static HTML/Parquet bundle')
+    parser.add_argument('--institution', nargs=3, action='append', metavar=('NAME', 'OPENALEX_ID', 'DATA_DIR'))
+    parser.add_argument('--config', help='csv with institution, openalex_id and data_dir columns')
+    parser.add_argument('--output', default=REPORT_DIR)
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, defaults to the number of cores')
+    parser.add_argument('--maxallowed', type=int, default=20, help='journal titles per journal chart')
+    parser.add_argument('--years', type=int, nargs=2, metavar=('FIRST', 'LAST'), help='only these PubYears')
+    parser.add_argument('--open-access', nargs='+', help='only these Open Access statuses')
+    parser.add_argument('--publisher', nargs='+', help='only these publishers')
+    parser.add_argument('--cache-dir', default=FIGURE_CACHE_DIR)
+    args = parser.parse_args()
+
+    profile_filter = ProfileFilter.make(years=args.years, open_access=args.open_access, publishers=args.publisher)
+    pages, built, reused = run_report(read_institutions(args), output=args.output, workers=args.workers,
+                                      maxallowed=args.maxallowed, profile_filter=profile_filter, cache_dir=args.cache_dir)
+    if not pages:
+        print('No merged files found, nothing written')
+    else:
+        print(f'{len(pages)} institutions written to {os.path.join(args.output, "index.html")}, '
+              f'{built} figures built, {reused} reused from {args.cache_dir}')
+
+
+if __name__ == '__main__':
+    main()
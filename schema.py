@@ -0,0 +1,139 @@
+# Compact in-memory schema for the merged publications file
+# Flags become nullable booleans instead of 'yes'/'no'/'unknown' strings, the repeated text columns become
+# categoricals, PubYear a small int, and the wide text columns are only read when someone asks for them
+
+import os
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from exports import write_atomic
+
+# yes/no flags, 'unknown' (no corresponding author info yet) becomes <NA>
+FLAG_COLUMNS = ['is_corresponding', 'is_USFF']
+# the old string concatenations of the two flags, rebuilt with combine_flags when needed
+COMBINED_FLAG_COLUMNS = ['is_corresponding_is_USFF', 'is_USFF_is_corresponding']
+CATEGORY_COLUMNS = ['Publisher', 'Source title', 'Open Access']
+
+# what the cube, the funder matching and the exports need
+CORE_COLUMNS = ['DOI', 'PubYear', 'is_corresponding', 'is_USFF', 'Publisher', 'Source title', 'Open Access', 'Funder']
+# long text, only shown in the chosen funder table
+DETAIL_COLUMNS = ['Title', 'ISSN', 'Authors', 'Authors (Raw Affiliation)', 'Corresponding Authors',
+                  'Authors Affiliations', 'Research Organizations - standardized']
+
+# compact files read back with True/False (object dtype when there are nulls), old files with 'yes'/'no'
+FLAG_VALUES = {'yes': True, 'no': False, True: True, False: False}
+
+
+def to_compact(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Input: merged dataframe, with 'yes'/'no' string flags or already compact
+    Returns: copy with boolean flags, categoricals, small int PubYear and no combined flag columns
+    '''
+    df = df.drop(columns=[c for c in COMBINED_FLAG_COLUMNS if c in df])
+    for column in FLAG_COLUMNS:
+        if column in df and df[column].dtype != 'boolean':
+            df[column] = df[column].map(FLAG_VALUES).astype('boolean')
+    for column in CATEGORY_COLUMNS:
+        if column in df and df[column].dtype != 'category':
+            df[column] = df[column].astype('category')
+    if 'PubYear' in df:
+        year = pd.to_numeric(df['PubYear'], errors='coerce')
+        df['PubYear'] = year.astype('Int16' if year.hasnans else 'int16')
+    return df
+
+
+def flag_labels(flag: pd.Series) -> pd.Series:
+    '''Boolean flag back to the 'yes' / 'no' / 'unknown' labels the charts use, string flags pass through'''
+    if flag.dtype in ('boolean', 'bool'):
+        return flag.map({True: 'yes', False: 'no'}).fillna('unknown').astype(object)
+    return flag
+
+
+def combine_flags(df: pd.DataFrame) -> pd.DataFrame:
+    '''Adds is_corresponding_is_USFF and is_USFF_is_corresponding ('yes_no' etc.) from the two flags'''
+    is_corresponding = flag_labels(df['is_corresponding']).astype(str)
+    is_USFF = flag_labels(df['is_USFF']).astype(str)
+    return df.assign(is_corresponding_is_USFF=is_corresponding + '_' + is_USFF,
+                     is_USFF_is_corresponding=is_USFF + '_' + is_corresponding)
+
+
+def to_labels(df: pd.DataFrame, column_order=()) -> pd.DataFrame:
+    '''
+    Input: compact dataframe, column order to follow (e.g. the merged file's)
+    Returns: copy in the format the merged files and exports have always had, 'yes'/'no'/'unknown' flags plus the
+             combined flag columns, with the columns in column_order first and any others after them
+    '''
+    df = df.assign(**{column: flag_labels(df[column]) for column in FLAG_COLUMNS if column in df})
+    if all(column in df for column in FLAG_COLUMNS):
+        df = combine_flags(df)
+    order = [c for c in column_order if c in df]
+    return df[order + [c for c in df.columns if c not in order]]
+
+
+def is_yes_yes(df: pd.DataFrame) -> pd.Series:
+    '''Corresponding authored and US federally funded, works on compact and string flags'''
+    return (flag_labels(df['is_corresponding']) == 'yes') & (flag_labels(df['is_USFF']) == 'yes')
+
+
+def _file_columns(path):
+    return pq.read_schema(path).names
+
+
+def read_compact(path, columns=CORE_COLUMNS, filters=None) -> pd.DataFrame:
+    '''
+    Input: merged parquet file, the columns this section needs (defaults to CORE_COLUMNS),
+           optional pd.read_parquet filters (e.g. filters.ProfileFilter.parquet_filters) so pyarrow skips those rows
+    Returns: compact dataframe with just those columns, repeated text read straight into categoricals,
+             on a fresh 0..n-1 index whatever index the file was saved with
+    '''
+    present = _file_columns(path)
+    columns = [c for c in columns if c in present]
+    df = pd.read_parquet(path, columns=columns, read_dictionary=[c for c in CATEGORY_COLUMNS if c in columns], filters=filters)
+    # a file saved with its (possibly duplicated) index would break the index-aligned joins in build_profile
+    return to_compact(df.reset_index(drop=True))
+
+
+def read_detail(path, dois, columns=DETAIL_COLUMNS, filters=None) -> pd.DataFrame:
+    '''
+    Wide text columns, loaded on demand
+    Input: merged parquet file, DOIs to fetch, optional extra pd.read_parquet filters (e.g. the sidebar's PubYear range)
+    Returns: DOI plus whichever of columns the file has, one row per matching record
+    '''
+    present = _file_columns(path)
+    columns = ['DOI'] + [c for c in columns if c in present and c != 'DOI']
+    if len(dois) == 0:      # pyarrow can't type an empty 'in' list
+        return pd.DataFrame(columns=columns)
+    return pd.read_parquet(path, columns=columns, filters=[('DOI', 'in', list(dois))] + (filters or []))
+
+
+def with_detail(df: pd.DataFrame, path, profile_filter=None) -> pd.DataFrame:
+    '''
+    df with the wide text columns for its DOIs joined back on from the merged file
+    A filters.ProfileFilter df was already filtered with is pushed down into the read too, so fewer row groups get decoded
+    '''
+    filters = profile_filter.parquet_filters(pq.read_schema(path)) if profile_filter is not None else None
+    detail = read_detail(path, df['DOI'].dropna().unique(), filters=filters).drop_duplicates(subset='DOI')
+    return df.merge(detail, on='DOI', how='left')
+
+
+def write_merged(df: pd.DataFrame, path):
+    '''
+    Rewrites a merged file (e.g. after enrich.py) in the format it came in, string flags, combined flag columns and
+    plain text columns in the file's own column order, so anything else reading it sees no difference
+    '''
+    column_order = _file_columns(path) if os.path.exists(path) else ()
+    df = to_labels(df, column_order)
+    df = df.astype({c: object for c in CATEGORY_COLUMNS if c in df})
+    if 'PubYear' in df:
+        df['PubYear'] = df['PubYear'].astype('Int64' if df['PubYear'].hasnans else 'int64')
+    write_atomic(path, lambda tmp_path: df.to_parquet(tmp_path, index=False))
+
+
+def write_compact(df: pd.DataFrame, path):
+    '''
+    Stores the compact schema, so later reads don't have to convert the flags again
+    Swapped in whole like write_merged, the app and warm_start.py may be reading path at the same time
+    '''
+    df = to_compact(df)
+    write_atomic(path, lambda tmp_path: df.to_parquet(tmp_path, index=False, compression='zstd'))
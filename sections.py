@@ -0,0 +1,62 @@
+# Dashboard sections for the IOI Publishing Profiler
+# Any widget used to rerun the whole script, so all fourteen figures. Each section is now a function of the
+# inputs it's handed, and the ones with widgets are st.fragments: a widget inside one reruns just that section
+# (and any section nested in it), everything else stays on screen as it was
+#
+# Every section run is timed, add ?render_times=1 to the app's URL to see the times under each section,
+# or ?debug=1 for the full stage trace (see instrumentation.py) in the sidebar
+
+import logging
+from functools import wraps
+from time import perf_counter
+
+import streamlit as st
+
+from instrumentation import Trace, current_trace, stage
+
+logger = logging.getLogger(__name__)
+
+
+def show_render_times():
+    return 'render_times' in st.query_params or debug_enabled()
+
+
+def debug_enabled():
+    return 'debug' in st.query_params
+
+
+def section(name, interactive=False):
+    '''
+    Decorator for one dashboard section, everything it needs comes in as arguments
+    interactive=True makes it an st.fragment, so its own widgets only rerun this section
+    Each run's wall time (ms) is logged and kept in st.session_state['render_times'][name],
+    and recorded as a stage of the open trace
+    '''
+    def decorate(func):
+        @wraps(func)
+        def run(*args, **kwargs):
+            trace = current_trace()
+            rerun_trace = None
+            if debug_enabled() and (trace is None or trace.finished):
+                # a fragment rerun, the full run's trace has already been written
+                rerun_trace = Trace(f'{name} rerun', memory=True).start()
+
+            start = perf_counter()
+            try:
+                with stage(f'section {name}'):
+                    result = func(*args, **kwargs)
+            finally:
+                # also when the section is cut short by st.stop() or a rerun
+                if rerun_trace is not None:
+                    rerun_trace.finish()
+            elapsed = (perf_counter() - start) * 1000
+
+            if rerun_trace is not None:
+                rerun_trace.write()
+            st.session_state.setdefault('render_times', {})[name] = elapsed
+            logger.info('section %r rendered in %.0f ms', name, elapsed)
+            if show_render_times():
+                st.caption(f'{name}: {elapsed:.0f} ms')
+            return result
+        return st.fragment(run) if interactive else run
+    return decorate
@@ -0,0 +1,107 @@
+# Shared, read-only cache for the big objects (merged profile, funder mapping, aggregated tables)
+# st.cache_data pickles and copies what it returns for every caller, so N viewers of one institution meant N copies.
+# This keeps one copy per process for every session, and evicts the least recently used entries past a size limit.
+#
+# Whatever comes out of here is shared, don't modify it in place (assign/copy first)
+
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+def size_of(value):
+    '''
+    Rough size in bytes of a cached value (dataframes, series, arrays, figures and tuples/lists/dicts of them)
+    Anything else with an nbytes (e.g. funders.FunderIndex) is sized by that
+    '''
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, np.ndarray) or hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    if hasattr(value, 'to_plotly_json'):     # plotly figures, sized by the JSON they turn into
+        return len(value.to_json(validate=False))
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(size_of(v) for v in value.values())
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(size_of(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class SharedFrameCache:
+    '''
+    Thread-safe LRU cache bounded by total size, one instance per server process (see st.cache_resource)
+
+    Entries can belong to a group (e.g. the merged file path), building a new key
+    in a group drops the group's older entries (e.g. the previous version of that file)
+    '''
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()       # key -> (value, size, group)
+        self._building = {}                 # key -> lock, so two sessions don't build the same thing at once
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, key, build, group=None):
+        '''
+        Input: hashable key, function building the value, optional group
+        Returns: the cached value, built once and shared with every caller
+        '''
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            build_lock = self._building.setdefault(key, threading.Lock())
+
+        with build_lock:
+            # somebody else may have built it while we waited
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key][0]
+                self.misses += 1
+
+            value = build()
+            size = size_of(value)
+
+            with self._lock:
+                if group is not None:
+                    for stale in [k for k, (_, _, g) in self._entries.items() if g == group]:
+                        del self._entries[stale]
+                self._entries[key] = (value, size, group)
+                self._evict(keep=key)
+                self._building.pop(key, None)
+        return value
+
+    def _evict(self, keep):
+        # oldest first, but never the entry we just built even if it's bigger than the limit by itself
+        total = sum(size for _, size, _ in self._entries.values())
+        for key in list(self._entries):
+            if total <= self.max_bytes:
+                break
+            if key != keep:
+                total -= self._entries.pop(key)[1]
+
+    def items(self, prefix=()):
+        '''(key, value) of the cached entries whose tuple key starts with prefix, without counting as a use'''
+        with self._lock:
+            return [(key, value) for key, (value, _, _) in self._entries.items()
+                    if isinstance(key, tuple) and key[:len(prefix)] == prefix]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        '''dataframe of what's cached, most recently used last'''
+        with self._lock:
+            rows = [(str(key), size / 2**20, None if group is None else str(group)) for key, (_, size, group) in self._entries.items()]
+        return pd.DataFrame(rows, columns=['key', 'MB', 'group'])
@@ -0,0 +1,95 @@
+# Summary store - one small columnar table of yearly counts for every institution
+# PubYear x is_corresponding x is_USFF publication counts, keyed by OpenAlex institution ID and institution name
+# (two entries of institutions.py can share an ID, e.g. a test copy of a real institution).
+# batch.py writes it for every institution it runs, the dashboard adds whichever institution it loads,
+# and the comparison page (pages/Compare_Institutions.py) reads it without touching any DOI-level file
+
+import os
+import threading
+
+import pandas as pd
+
+from exports import write_atomic
+from institutions import DATA_ROOT
+
+SUMMARY_FILE = os.path.join(DATA_ROOT, 'summary_store.parquet')
+SUMMARY_COLUMNS = ['institution', 'institution_id', 'source_hash', 'PubYear', 'is_corresponding', 'is_USFF', 'DOI']
+STORE_KEY = ['institution_id', 'institution']
+
+# one read-modify-write of the store at a time in this process
+_store_lock = threading.Lock()
+
+
+def summarize(cube: pd.DataFrame, institution, institution_id, source_hash=None) -> pd.DataFrame:
+    '''
+    Input: one institution's cube (aggregates.build_cube), its name and OpenAlex ID,
+           hash of the merged file the cube came from
+    Returns: that institution's rows of the summary store
+    '''
+    summary = cube.groupby(['PubYear', 'is_corresponding', 'is_USFF'], observed=True)['DOI'].sum().reset_index()
+    summary.insert(0, 'source_hash', source_hash)
+    summary.insert(0, 'institution_id', institution_id)
+    summary.insert(0, 'institution', institution)
+    return summary[SUMMARY_COLUMNS]
+
+
+def read_summary(path=SUMMARY_FILE, institution_ids=None) -> pd.DataFrame:
+    '''
+    Input: store file, optionally just these institution IDs
+    Returns: summary rows, empty if the store doesn't exist yet
+    '''
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=SUMMARY_COLUMNS)
+    filters = [('institution_id', 'in', list(institution_ids))] if institution_ids is not None else None
+    return pd.read_parquet(path, filters=filters)
+
+
+def stored_hash(institution_id, institution=None, path=SUMMARY_FILE):
+    '''source_hash the store has for this institution (ID, and name if given), None if it isn't in there'''
+    rows = read_summary(path, [institution_id])
+    if institution is not None:
+        rows = rows[rows['institution'].astype(str) == institution]
+    return rows['source_hash'].iloc[0] if len(rows) else None
+
+
+def _store_keys(frame):
+    return pd.MultiIndex.from_frame(frame[STORE_KEY].astype(str))
+
+
+def update_summary(summaries, path=SUMMARY_FILE) -> pd.DataFrame:
+    '''
+    Input: summarize() output for one or more institutions
+    Replaces those institutions' rows (same ID and name) in the store, everybody else's stay as they are
+    Returns: the whole store
+    '''
+    summaries = pd.concat(summaries) if isinstance(summaries, list) else summaries
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    with _store_lock:
+        store = read_summary(path)
+        store = store[~_store_keys(store).isin(_store_keys(summaries))]
+        store = pd.concat([store.astype({c: object for c in STORE_KEY}), summaries], ignore_index=True)
+        store = store.sort_values(['institution', 'PubYear'], kind='stable', ignore_index=True)
+        store = store.astype({'institution': 'category', 'institution_id': 'category', 'is_corresponding': 'category',
+                              'is_USFF': 'category', 'DOI': 'int64'})
+
+        # the comparison page may be reading it
+        write_atomic(path, lambda tmp_path: store.to_parquet(tmp_path, index=False, compression='zstd'))
+    return store
+
+
+def shares(summary: pd.DataFrame, flag: str, value='yes') -> pd.DataFrame:
+    '''
+    Input: summary rows, flag column ('is_corresponding', 'is_USFF', or 'yes_yes' for both at once)
+    Returns: institution, PubYear, DOI (records with the flag), total, percent - one row per institution and year
+    '''
+    summary = summary.astype({c: object for c in ('institution', 'institution_id', 'is_corresponding', 'is_USFF')})
+    if flag == 'yes_yes':
+        flagged = (summary['is_corresponding'] == value) & (summary['is_USFF'] == value)
+    else:
+        flagged = summary[flag] == value
+    table = summary.assign(flagged=summary['DOI'].where(flagged, 0))
+    table = table.groupby(['institution', 'PubYear'])[['flagged', 'DOI']].sum().reset_index()
+    table = table.rename(columns={'DOI': 'total', 'flagged': 'DOI'})
+    table['percent'] = (table['DOI'] / table['total'] * 100).round(2)
+    return table[['institution', 'PubYear', 'DOI', 'total', 'percent']]
@@ -0,0 +1,130 @@
+# enrich.py against a local mock of the OpenAlex works endpoint (http.server on 127.0.0.1), no network needed
+# Run from the repo root:  python -m pytest tests
+
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from enrich import BATCH_SIZE, OpenAlexClient, enrich_corresponding
+from schema import flag_labels
+
+INSTITUTION_ID = 'I173911158'
+ROWS = 120
+
+
+def mock_work(doi):
+    '''
+    What the mock OpenAlex says about 10.1000/x<n>:
+    n % 5 == 0 isn't in OpenAlex, n % 3 == 0 has no corresponding author flagged,
+    otherwise the corresponding author is from INSTITUTION_ID for odd n and from somewhere else for even n
+    '''
+    n = int(doi.rsplit('x', 1)[1])
+    if n % 5 == 0:
+        return None
+    institution = INSTITUTION_ID if n % 2 else 'I999'
+    return {'doi': 'https://doi.org/' + doi.upper(),
+            'authorships': [{'is_corresponding': n % 3 != 0, 'institutions': [{'id': f'https://openalex.org/{institution}'}]}]}
+
+
+def expected_statuses(rows=ROWS):
+    statuses = ['unknown' if n % 5 == 0 or n % 3 == 0 else 'yes' if n % 2 else 'no' for n in range(rows)]
+    return pd.Series(statuses, name='is_corresponding', dtype=object)
+
+
+class MockOpenAlex:
+    '''Answers filter=doi:a|b|c like the works endpoint, records every request, can answer 429s first'''
+
+    def __init__(self, rate_limited=0):
+        self.requests = []          # DOIs asked for, one list per request (429s included)
+        self.rate_limited = rate_limited
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                dois = query['filter'][0][len('doi:'):].split('|')
+                mock.requests.append(dois)
+                if mock.rate_limited:
+                    mock.rate_limited -= 1
+                    self.send_response(429)
+                    self.send_header('Retry-After', '0')
+                    self.end_headers()
+                    return
+                results = [work for work in map(mock_work, dois) if work is not None]
+                body = json.dumps({'results': results}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/works'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def openalex():
+    mock = MockOpenAlex()
+    yield mock
+    mock.close()
+
+
+def merged_frame(rows=ROWS):
+    return pd.DataFrame({'DOI': [f'10.1000/x{n}' for n in range(rows)],
+                         'PubYear': 2020,
+                         'is_corresponding': 'unknown',
+                         'is_USFF': 'yes'})
+
+
+def enrich(merged, openalex, cache_path):
+    client = OpenAlexClient(base_url=openalex.url, requests_per_second=200, backoff=0.01)
+    return enrich_corresponding(merged, INSTITUTION_ID, cache_path=str(cache_path), client=client, show_progress=False)
+
+
+def test_statuses_come_from_openalex_in_batches(openalex, tmp_path):
+    enriched = enrich(merged_frame(), openalex, tmp_path / 'cache.sqlite')
+
+    pd.testing.assert_series_equal(flag_labels(enriched['is_corresponding']), expected_statuses())
+    # every DOI asked for exactly once, at most BATCH_SIZE per request
+    assert sorted(len(dois) for dois in openalex.requests) == [ROWS - 2 * BATCH_SIZE, BATCH_SIZE, BATCH_SIZE]
+    assert sorted(doi for dois in openalex.requests for doi in dois) == sorted(merged_frame()['DOI'])
+
+
+def test_rate_limited_requests_are_retried(tmp_path):
+    openalex = MockOpenAlex(rate_limited=2)
+    try:
+        enriched = enrich(merged_frame(), openalex, tmp_path / 'cache.sqlite')
+    finally:
+        openalex.close()
+    assert len(openalex.requests) == 3 + 2
+    pd.testing.assert_series_equal(flag_labels(enriched['is_corresponding']), expected_statuses())
+
+
+def test_second_run_is_served_from_the_cache(openalex, tmp_path):
+    cache_path = tmp_path / 'cache.sqlite'
+    first = enrich(merged_frame(), openalex, cache_path)
+    openalex.requests.clear()
+
+    second = enrich(merged_frame(), openalex, cache_path)
+    assert openalex.requests == []
+    pd.testing.assert_frame_equal(first, second)
+
+    # only the DOIs the cache hasn't seen get asked for
+    enrich(merged_frame(ROWS + 10), openalex, cache_path)
+    pd.testing.assert_index_equal(pd.Index(sorted(doi for dois in openalex.requests for doi in dois)),
+                                  pd.Index(sorted(f'10.1000/x{n}' for n in range(ROWS, ROWS + 10))))
@@ -0,0 +1,75 @@
+# incremental_merge.ingest: only changed slices get merged, and a new USFF list re-merges everything already ingested
+# Run from the repo root:  python -m pytest tests
+
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from incremental_merge import ingest, read_merged
+
+INSTITUTION = 'TestUniversity'
+
+
+def write_slice(directory, year, rows=50):
+    '''one year of a Dimensions export, as parquet so there's no header line to skip'''
+    path = os.path.join(directory, f'export_{year}.parquet')
+    pd.DataFrame({'DOI': [f'10.1000/{year}.{i}' for i in range(rows)],
+                  'PubYear': year,
+                  'Publisher': 'Pub',
+                  'Source title': 'Journal',
+                  'Open Access': 'Closed',
+                  'Funder': None}).to_parquet(path, index=False)
+    return path
+
+
+def write_usff(path, dois):
+    pd.DataFrame({'DOI': list(dois)}).to_csv(path, index=False)
+    return str(path)
+
+
+@pytest.fixture
+def slices(tmp_path):
+    return {year: write_slice(str(tmp_path), year) for year in (2016, 2017, 2018)}
+
+
+def usff_share(dataset_dir):
+    '''share of each PubYear's records flagged is_USFF in the dataset'''
+    merged = read_merged(INSTITUTION, dataset_dir)
+    return merged.groupby('PubYear')['is_USFF'].mean().astype(float)
+
+
+def expected_share(shares):
+    return pd.Series(shares, name='is_USFF').rename_axis('PubYear')
+
+
+def test_unchanged_slices_are_skipped(tmp_path, slices):
+    dataset_dir = str(tmp_path / 'dataset')
+    usff = write_usff(tmp_path / 'usff.csv', ['10.1000/2016.1', '10.1000/2017.2'])
+    assert ingest([slices[2016], slices[2017]], usff, INSTITUTION, dataset_dir) == [slices[2016], slices[2017]]
+    assert ingest([slices[2016], slices[2017], slices[2018]], usff, INSTITUTION, dataset_dir) == [slices[2018]]
+    assert ingest([slices[2018]], usff, INSTITUTION, dataset_dir) == []
+
+
+def test_new_usff_list_remerges_earlier_slices(tmp_path, slices):
+    dataset_dir = str(tmp_path / 'dataset')
+    old_usff = write_usff(tmp_path / 'usff_old.csv', [f'10.1000/{year}.{i}' for year in (2016, 2017) for i in range(10)])
+    ingest([slices[2016], slices[2017]], old_usff, INSTITUTION, dataset_dir)
+    pd.testing.assert_series_equal(usff_share(dataset_dir), expected_share({2016: 0.2, 2017: 0.2}), check_index_type=False)
+
+    # every DOI is federally funded in the new list, and only the 2018 slice is passed this time
+    new_usff = write_usff(tmp_path / 'usff_new.csv', [f'10.1000/{year}.{i}' for year in (2016, 2017, 2018) for i in range(50)])
+    ingested = ingest([slices[2018]], new_usff, INSTITUTION, dataset_dir)
+    assert sorted(ingested) == sorted(slices.values())
+    pd.testing.assert_series_equal(usff_share(dataset_dir), expected_share({2016: 1.0, 2017: 1.0, 2018: 1.0}), check_index_type=False)
+
+
+def test_new_usff_list_with_a_missing_earlier_slice(tmp_path, slices):
+    dataset_dir = str(tmp_path / 'dataset')
+    ingest([slices[2016], slices[2017]], write_usff(tmp_path / 'usff_old.csv', ['10.1000/2016.1']), INSTITUTION, dataset_dir)
+    os.remove(slices[2016])
+    with pytest.raises(FileNotFoundError, match='export_2016'):
+        ingest([slices[2018]], write_usff(tmp_path / 'usff_new.csv', ['10.1000/2018.1']), INSTITUTION, dataset_dir)
@@ -0,0 +1,81 @@
+# stream_profile (a batch of rows at a time) has to give exactly what build_profile(load_merged(...)) gives
+# Run from the repo root:  python -m pytest tests
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from filters import ProfileFilter
+from funders import FUNDER_LOOKUP_FILE, load_funder_matcher
+from pipeline import build_profile, load_merged, stream_profile
+from bench_streaming import assert_same_cube, assert_same_profile
+from synthetic import synthetic_merged
+
+ROWS = 20_000
+
+
+@pytest.fixture(scope='module')
+def matcher():
+    return load_funder_matcher(os.path.join(ROOT, FUNDER_LOOKUP_FILE))
+
+
+@pytest.fixture(scope='module')
+def merged_file(tmp_path_factory):
+    path = tmp_path_factory.mktemp('streaming') / 'test_merged_small.parquet'
+    synthetic_merged(ROWS, detail=False).to_parquet(path, index=False)
+    return str(path)
+
+
+@pytest.fixture(scope='module')
+def gappy_file(tmp_path_factory):
+    '''same shape, with missing Publisher and DOI values scattered through it'''
+    merged = synthetic_merged(ROWS, seed=1, detail=False)
+    rng = np.random.default_rng(1)
+    merged.loc[rng.random(ROWS) < 0.05, 'Publisher'] = None
+    merged.loc[rng.random(ROWS) < 0.02, 'DOI'] = None
+    path = tmp_path_factory.mktemp('streaming') / 'gappy_merged_small.parquet'
+    merged.to_parquet(path, index=False)
+    return str(path)
+
+
+# 5_000 divides the row count, 7_919 leaves a short last batch, 50_000 is one batch for the whole file
+@pytest.mark.parametrize('batch_size', [5_000, 7_919, 50_000])
+def test_stream_matches_in_memory(merged_file, matcher, batch_size):
+    expected = build_profile(load_merged(merged_file), matcher)
+    assert_same_profile(expected, stream_profile(merged_file, matcher, batch_size=batch_size))
+
+
+@pytest.mark.parametrize('batch_size', [3_000, 7_919])
+def test_stream_matches_in_memory_with_missing_values(gappy_file, matcher, batch_size):
+    expected = build_profile(load_merged(gappy_file), matcher)
+    assert_same_profile(expected, stream_profile(gappy_file, matcher, batch_size=batch_size))
+
+
+@pytest.mark.parametrize('batch_size', [4_000, 7_919])
+def test_stream_matches_in_memory_filtered(merged_file, matcher, batch_size):
+    profile_filter = ProfileFilter.make(years=(2018, 2021), open_access=['Closed', 'All OA; Gold'])
+    expected = build_profile(load_merged(merged_file, profile_filter=profile_filter), matcher)
+    streamed = stream_profile(merged_file, matcher, batch_size=batch_size, profile_filter=profile_filter)
+    assert_same_profile(expected, streamed)
+
+
+def test_stream_with_precomputed_cube(merged_file, matcher):
+    expected = build_profile(load_merged(merged_file), matcher)
+    streamed = stream_profile(merged_file, matcher, cube=expected[2], batch_size=6_000)
+    assert_same_profile(expected, streamed)
+
+
+@pytest.mark.parametrize('batch_size', [5_000, 7_919])
+def test_stream_cube_only(merged_file, matcher, batch_size):
+    profile_filter = ProfileFilter.make(years=(2017, 2022))
+    cube = build_profile(load_merged(merged_file, profile_filter=profile_filter), matcher)[2]
+    yesyes, funders_exploded, s_cube = stream_profile(merged_file, matcher, batch_size=batch_size,
+                                                      profile_filter=profile_filter, keep_rows=False)
+    assert yesyes is None and funders_exploded is None
+    assert_same_cube(cube, s_cube)
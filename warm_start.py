@@ -0,0 +1,56 @@
+# Warm start for the IOI Publishing Profiler server
+# Builds the precomputed cube (pipeline.cube_path) for every institution in institutions.py that doesn't have one
+# for its current merged file yet, so the first visitor's load skips the biggest groupby.
+# .devcontainer runs it alongside the server when the codespace starts:
+#
+#   python warm_start.py
+#
+# The app then warms its own in-memory caches for every institution once the first page has been drawn (see warm_start in the app)
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from aggregates import file_hash
+from institutions import INSTITUTION_IDS, data_dir
+from pipeline import find_merged_file, cube_path, profile_merged_file
+
+
+def warm_cube(institution_name):
+    '''
+    Input: institution name from institutions.py
+    Returns: 'built', 'cached' or 'no merged file', runs in a worker process
+    '''
+    institution_dir = data_dir(institution_name)
+    merged_file = find_merged_file(institution_dir)
+    if merged_file is None:
+        return 'no merged file'
+    source_hash = file_hash(merged_file)
+    if os.path.exists(cube_path(institution_dir, source_hash)):
+        return 'cached'
+    profile_merged_file(merged_file, source_hash=source_hash, keep_rows=False, save=True)
+    return 'built'
+
+
+def warm_cubes(institution_names=INSTITUTION_IDS, workers=None) -> pd.DataFrame:
+    '''
+    Input: institution names (defaults to everything in institutions.py)
+    Returns: institution, status - one row per institution
+    '''
+    names = list(institution_names)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        statuses = list(pool.map(warm_cube, names))
+    return pd.DataFrame({'institution': names, 'status': statuses})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Precompute the cube of every institution the app knows about')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, defaults to the number of cores')
+    args = parser.parse_args()
+    print(warm_cubes(workers=args.workers).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()